@@ -4,12 +4,34 @@ Created on Tue May 29 17:11:25 2018
 @author: Emma C.  Robinson
 
 Blind source separation of sound waves:
-    
-    based on the Scikit-Learn Tutorial 
+
+    based on the Scikit-Learn Tutorial
     http://scikit-learn.org/stable/auto_examples/decomposition/plot_ica_blind_source_separation.html
-    
+
+Run without arguments for the demo on Data/mix1.wav and Data/mix2.wav.
+
+Long multichannel recordings (one WAV/NPY file per channel, or one multichannel
+file) can be separated in streaming mode: the sources are memory-mapped, the
+unmixing matrix is fitted on a random subsample of time points, and the signal
+is then unmixed and written (one file per component) a chunk at a time, so that
+memory use does not grow with the length of the recording:
+
+    python BlindSourceSeparation.py --stream ecg1.wav ecg2.wav ecg3.wav --output ecg_unmix --n-components 3
+
+Many recordings can be separated in a pool of worker processes from a manifest
+(one recording per line, its channel files separated by commas). PCA and ICA
+share each recording's centring and whitening (PCA), and the time taken by
+every recording is written to timings.csv in the output folder:
+
+    python BlindSourceSeparation.py --manifest recordings.txt --output-dir separated --n-jobs 8
 """
 
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy import signal
@@ -17,70 +39,368 @@ from scipy.io import wavfile
 
 from sklearn.decomposition import FastICA, PCA
 
-# #############################################################################
 
-# load mixed audio files
-samplingRate, signal1 = wavfile.read('Data/mix1.wav')
-print("Sampling rate = ", samplingRate)
-print("Data type is ", signal1.dtype)
+def open_source(path):
+    ''' Memory-map an audio source: a WAV file, or a .npy array of (n_samples,) or
+        (n_samples, n_channels) with its sampling rate in a sibling <name>.rate.txt file
+        output:
+            samplingRate: samples per second
+            data: memory-mapped array (n_samples,) or (n_samples, n_channels)
+    '''
+    if path.endswith('.npy'):
+        with open(path[:-4] + '.rate.txt') as f:
+            samplingRate = int(f.read())
+        return samplingRate, np.load(path, mmap_mode='r')
+    return wavfile.read(path, mmap=True)
+
+
+def open_recording(paths):
+    ''' Memory-map the channels of a recording, given as one file per channel or as
+        a single multichannel file
+        output:
+            samplingRate: samples per second
+            channels: list of memory-mapped arrays (n_samples,), one per channel
+    '''
+    channels = []
+    for path in paths:
+        samplingRate, data = open_source(path)
+        channels.extend([data] if data.ndim == 1 else [data[:, i] for i in range(data.shape[1])])
+    if len(set(len(channel) for channel in channels)) > 1:
+        raise ValueError('channels have different numbers of samples')
+    return samplingRate, channels
+
+
+def read_chunk(channels, start, stop):
+    ''' Samples start to stop of every channel, as an array (stop-start, n_channels) '''
+    return np.stack([np.asarray(channel[start:stop], dtype=float) for channel in channels], axis=1)
+
+
+def read_sample(channels, sample_size=200000, random_state=0):
+    ''' Random subsample of time points of a recording, read from the memory-mapped channels
+        input:
+            channels: list of channel arrays (see open_recording)
+            sample_size: number of time points (all if the recording is shorter)
+            random_state: fixes the subsample
+        output:
+            X: samples (sample_size, n_channels), in time order
+    '''
+    rng = np.random.default_rng(random_state)
+    n_samples = len(channels[0])
+    times = np.sort(rng.choice(n_samples, min(sample_size, n_samples), replace=False))
+    return np.stack([np.asarray(channel[times], dtype=float) for channel in channels], axis=1)
+
+
+def fit_unmixing(channels, n_components, sample_size=200000, random_state=0, **ica_kwargs):
+    ''' Fit FastICA (with whitening) on a random subsample of time points of the recording,
+        read from the memory-mapped channels
+        input:
+            channels: list of channel arrays (see open_recording)
+            n_components: number of sources
+            sample_size: number of time points in the subsample (all if the recording is shorter)
+            random_state: fixes the subsample and the ICA initialisation
+            ica_kwargs: other FastICA parameters (e.g. fun='exp')
+        output:
+            ica: fitted FastICA, whose transform unmixes chunks of the recording
+    '''
+    X = read_sample(channels, sample_size, random_state)
+    ica = FastICA(n_components=n_components, whiten='unit-variance', random_state=random_state, **ica_kwargs)
+    return ica.fit(X)
+
+
+def open_wav_output(path, samplingRate, n_samples):
+    ''' Open a mono 32-bit float WAV file for writing n_samples samples a chunk at a time:
+        the header (which needs the data size) is written first
+        output:
+            f: file object positioned at the start of the data
+    '''
+    n_bytes = 4*n_samples
+    f = open(path, 'wb')
+    f.write(b'RIFF' + (36 + n_bytes).to_bytes(4, 'little') + b'WAVE')
+    # fmt chunk: IEEE float (format 3), 1 channel, sampling rate, byte rate, block align, bits per sample
+    f.write(b'fmt ' + (16).to_bytes(4, 'little') + np.array([3, 1], '<u2').tobytes()
+            + np.array([samplingRate, 4*samplingRate], '<u4').tobytes() + np.array([4, 32], '<u2').tobytes())
+    f.write(b'data' + n_bytes.to_bytes(4, 'little'))
+    return f
+
+
+def unmix_stream(channels, samplingRate, unmix, output_prefixes, n_components, chunk_size=2**16):
+    ''' Unmix a recording a chunk at a time, writing every component to its own WAV file
+        input:
+            channels: list of channel arrays (see open_recording)
+            samplingRate: samples per second
+            unmix: function mapping a chunk (chunk_size, n_channels) to a list of component
+                   arrays (chunk_size, n_components), one per output prefix (e.g. the
+                   principal and independent components, see WhitenedICA.components)
+            output_prefixes: output prefixes; component i is written to <prefix><i+1>.wav
+            n_components: number of components of every output
+            chunk_size: number of time points read, unmixed and written at a time
+    '''
+    n_samples = len(channels[0])
+    outputs = [[open_wav_output('{}{}.wav'.format(prefix, i+1), samplingRate, n_samples)
+                for i in range(n_components)] for prefix in output_prefixes]
+    try:
+        for start in range(0, n_samples, chunk_size):
+            X = read_chunk(channels, start, min(start + chunk_size, n_samples))
+            for components, files in zip(unmix(X), outputs):
+                components = components.astype('<f4')
+                for i, f in enumerate(files):
+                    f.write(components[:, i].tobytes())
+    finally:
+        for files in outputs:
+            for f in files:
+                f.close()
+
+
+def separate_stream(paths, output_prefix, n_components=None, chunk_size=2**16, sample_size=200000,
+                    random_state=0, **ica_kwargs):
+    ''' Streaming blind source separation of a long recording with FastICA: the unmixing
+        matrix is fitted on a subsample (fit_unmixing), then the memory-mapped recording
+        is unmixed chunk by chunk (unmix_stream) to <output_prefix>1.wav, 2.wav, ...
+        input:
+            paths: one file per channel, or a single multichannel file (WAV or NPY)
+            output_prefix: prefix of the output files
+            n_components: number of sources (by default, the number of channels)
+            chunk_size, sample_size, random_state, ica_kwargs: see unmix_stream and fit_unmixing
+        output:
+            ica: the fitted FastICA
+    '''
+    samplingRate, channels = open_recording(paths)
+    ica = fit_unmixing(channels, n_components or len(channels), sample_size, random_state, **ica_kwargs)
+    unmix_stream(channels, samplingRate, lambda X: [ica.transform(X)], [output_prefix], len(ica.components_),
+                 chunk_size)
+    return ica
+
+
+class WhitenedICA:
+    ''' FastICA applied to the whitened components of a fitted PCA, so that the centring
+        and whitening of the PCA are computed once and shared by both decompositions '''
+
+    def __init__(self, pca, ica):
+        self.pca = pca
+        self.ica = ica
+        self.n_components = pca.n_components_
+
+    def whiten(self, X):
+        ''' Principal components of X scaled to unit variance '''
+        return self.pca.transform(X) / np.sqrt(self.pca.explained_variance_)
+
+    def transform_whitened(self, H):
+        ''' Independent components from the principal components H = pca.transform(X) '''
+        return self.ica.transform(H / np.sqrt(self.pca.explained_variance_))
+
+    def transform(self, X):
+        ''' Independent components of X '''
+        return self.transform_whitened(self.pca.transform(X))
+
+    def components(self, X):
+        ''' Principal and independent components of X, from a single PCA projection '''
+        H = self.pca.transform(X)
+        return H, self.transform_whitened(H)
+
+    @property
+    def mixing_(self):
+        ''' Estimated mixing matrix, from the sources to the (centred) channels '''
+        return (self.pca.components_.T * np.sqrt(self.pca.explained_variance_)) @ self.ica.mixing_
+
+
+def fit_separation(X, n_components, random_state=0, **ica_kwargs):
+    ''' Fit PCA to X, then FastICA (without whitening of its own) to the whitened principal components
+        input:
+            X: signals (n_samples, n_channels)
+            n_components: number of sources
+            random_state: fixes the ICA initialisation
+            ica_kwargs: other FastICA parameters (e.g. fun='exp')
+        output:
+            pca: fitted PCA, whose transform gives the principal components
+            ica: fitted WhitenedICA, whose transform gives the independent components
+    '''
+    pca = PCA(n_components=n_components).fit(X)
+    # the whitened components already have n_components dimensions
+    model = WhitenedICA(pca, FastICA(whiten=False, random_state=random_state, **ica_kwargs))
+    model.ica.fit(model.whiten(X))
+    return pca, model
+
+
+def separate_recording(paths, output_prefix, n_components=None, chunk_size=2**16, sample_size=200000,
+                       random_state=0, **ica_kwargs):
+    ''' Separate one recording with PCA and ICA (sharing the whitening), fitted on a subsample
+        of time points, writing <output_prefix>_PCA1.wav, ... and <output_prefix>_FastICA1.wav, ...
+        chunk by chunk (see separate_stream for the parameters)
+        output:
+            timing: dict of the recording, its number of samples and the seconds spent
+                    fitting, unmixing and in total
+    '''
+    start = time.perf_counter()
+    samplingRate, channels = open_recording(paths)
+    n_samples = len(channels[0])
+    X = read_sample(channels, sample_size, random_state)
+    pca, ica = fit_separation(X, n_components or len(channels), random_state, **ica_kwargs)
+    fitted = time.perf_counter()
+    unmix_stream(channels, samplingRate, ica.components, [output_prefix + '_PCA', output_prefix + '_FastICA'],
+                 ica.n_components, chunk_size)
+    end = time.perf_counter()
+    return {'recording': output_prefix, 'n_samples': n_samples, 'fit_time': fitted - start,
+            'unmix_time': end - fitted, 'total_time': end - start}
+
+
+def read_manifest(path):
+    ''' Recordings listed in a manifest file: one line per recording, its channel files
+        separated by commas (lines starting with # are ignored)
+        output:
+            recordings: list of lists of channel files
+    '''
+    with open(path) as f:
+        return [[name.strip() for name in line.split(',')] for line in f
+                if line.strip() and not line.startswith('#')]
+
+
+def recording_names(recordings):
+    ''' Unique output name of every recording: the name of its first channel file without
+        extension, or, for recordings sharing a name, the path of that file relative to the
+        folder common to all of them, with separators and dots replaced by '_' '''
+    first = [paths[0] for paths in recordings]
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in first]
+    if len(set(stems)) == len(stems):
+        return stems
+    root = os.path.commonpath([os.path.abspath(os.path.dirname(path)) for path in first])
+    names = []
+    for path, stem in zip(first, stems):
+        if stems.count(stem) > 1:
+            stem = os.path.relpath(os.path.abspath(path), root).replace(os.sep, '_').replace('.', '_')
+        names.append(stem)
+    duplicates = sorted(name for name in set(names) if names.count(name) > 1)
+    if duplicates:
+        raise ValueError('recordings would overwrite each other\'s outputs: {}'.format(', '.join(duplicates)))
+    return names
+
+
+def separate_batch(recordings, output_dir, n_jobs=1, **separation_kwargs):
+    ''' Separate many recordings in a pool of worker processes
+        input:
+            recordings: list of lists of channel files (see read_manifest)
+            output_dir: folder for the outputs, named by recording_names
+            n_jobs: number of worker processes (-1 for all cores)
+            separation_kwargs: see separate_recording
+        output:
+            timings: list of the timing dicts of the recordings (see separate_recording)
+    '''
+    if not recordings:
+        raise ValueError('no recordings to separate')
+    prefixes = [os.path.join(output_dir, name) for name in recording_names(recordings)]
+    os.makedirs(output_dir, exist_ok=True)
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if n_jobs == 1:
+        return [separate_recording(paths, prefix, **separation_kwargs) for paths, prefix in zip(recordings, prefixes)]
+    with ProcessPoolExecutor(min(n_jobs, len(recordings))) as pool:
+        futures = [pool.submit(separate_recording, paths, prefix, **separation_kwargs)
+                   for paths, prefix in zip(recordings, prefixes)]
+        return [future.result() for future in futures]
+
+
+def write_timings(timings, path):
+    ''' Write the timings of every recording to a CSV file '''
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['recording', 'n_samples', 'fit_time', 'unmix_time', 'total_time'])
+        writer.writeheader()
+        writer.writerows(timings)
+
+
+def demo():
+    ''' Separate Data/mix1.wav and Data/mix2.wav, and plot the signals and their components '''
+    # load mixed audio files
+    samplingRate, signal1 = wavfile.read('Data/mix1.wav')
+    print("Sampling rate = ", samplingRate)
+    print("Data type is ", signal1.dtype)
+
+    samplingRate, signal2 = wavfile.read('Data/mix2.wav')
+    print("Sampling rate = ", samplingRate)
+    print("Data type is ", signal2.dtype)
+
+    # load source audio files for comparison
+    samplingRate, source1 = wavfile.read('Data/source1.wav')
+    samplingRate, source2 = wavfile.read('Data/source2.wav')
 
-samplingRate, signal2 = wavfile.read('Data/mix2.wav')
-print("Sampling rate = ", samplingRate)
-print("Data type is ", signal2.dtype)
+    # combine files into one matrix X
+    X= np.stack((signal1,signal2),axis=0).T # mixed signals
+    S= np.stack((source1,source2),axis=0).T # mixed signals
 
-# load source audio files for comparison
-samplingRate, source1 = wavfile.read('Data/source1.wav')
-samplingRate, source2 = wavfile.read('Data/source2.wav')
+    ###################### PLOT AUDIO SIGNALS ##############################
 
-# combine files into one matrix X
-X= np.stack((signal1,signal2),axis=0).T # mixed signals
-S= np.stack((source1,source2),axis=0).T # mixed signals
+    # plot MIXED signals
+    f, (ax1,ax2)=plt.subplots(2,1)
 
-###################### PLOT AUDIO SIGNALS ##############################
+    ax1.plot(X[:,0],'k')
+    ax2.plot(X[:,1],'k')
+    f.suptitle('Mixed signals')
+    # plot source signals
+    f, (ax1,ax2)=plt.subplots(2,1)
 
-# plot MIXED signals
-f, (ax1,ax2)=plt.subplots(2,1)
+    ax1.plot(S[:,0],'k')
+    ax2.plot(S[:,1],'k')
+    f.suptitle('Souce Signals')
 
-ax1.plot(X[:,0],'k')
-ax2.plot(X[:,1],'k')
-f.suptitle('Mixed signals')
-# plot source signals
-f, (ax1,ax2)=plt.subplots(2,1)
+    ######################## PERFORM DECOMPOSITION ##########################
 
-ax1.plot(S[:,0],'k')
-ax2.plot(S[:,1],'k')
-f.suptitle('Souce Signals')
+    # Compute PCA, then ICA on the whitened principal components, to extract two components
+    pca, ica = fit_separation(X, 2, fun='exp')
+    H = pca.transform(X)  # Reconstruct signals based on orthogonal components
+    S_ = ica.transform_whitened(H)  # Reconstruct signals
+    A_ = ica.mixing_  # Get estimated mixing matrix
 
-######################## PERFORM DECOMPOSITION ##########################
+    # save output
+    wavfile.write('Data/unmix_FastICA1.wav',samplingRate,S_[:,0])
+    wavfile.write('Data/unmix_FastICA2.wav',samplingRate,S_[:,1])
 
-# Compute ICA, to extract two components
-ica = FastICA(n_components=2, whiten=True,fun='exp')
-S_ = ica.fit_transform(X)  # Reconstruct signals
-A_ = ica.mixing_  # Get estimated mixing matrix
+    wavfile.write('Data/unmix_PCA1.wav',samplingRate,H[:,0])
+    wavfile.write('Data/unmix_PCA2.wav',samplingRate,H[:,1])
 
-# For comparison, compute PCA
-pca = PCA(n_components=2)
-H = pca.fit_transform(X)  # Reconstruct signals based on orthogonal components
+    # #################### PLOT RESULTS #####################################
 
-# save output
-wavfile.write('Data/unmix_FastICA1.wav',samplingRate,S_[:,0])
-wavfile.write('Data/unmix_FastICA2.wav',samplingRate,S_[:,1])
+    # plot ICA components
+    f, (ax1,ax2)=plt.subplots(2,1)
 
-wavfile.write('Data/unmix_PCA1.wav',samplingRate,S_[:,0])
-wavfile.write('Data/unmix_PCA2.wav',samplingRate,S_[:,1])
+    ax1.plot(S_[:,0],'k')
+    ax2.plot(S_[:,1],'k')
+    f.suptitle('ICA components')
 
-# #################### PLOT RESULTS #####################################
+    # plot source signals
+    f, (ax1,ax2)=plt.subplots(2,1)
 
-# plot ICA components
-f, (ax1,ax2)=plt.subplots(2,1)
+    ax1.plot(H[:,0],'k')
+    ax2.plot(H[:,1],'k')
+    f.suptitle('PCA components')
 
-ax1.plot(S_[:,0],'k')
-ax2.plot(S_[:,1],'k')
-f.suptitle('ICA components')
 
-# plot source signals
-f, (ax1,ax2)=plt.subplots(2,1)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Blind source separation of mixed recordings')
+    parser.add_argument('--stream', nargs='+', default=None,
+                        help='channel files (WAV/NPY) of a long recording to separate in streaming mode')
+    parser.add_argument('--manifest', default=None, help='file listing recordings to separate in a batch')
+    parser.add_argument('--output', default='unmix_FastICA', help='prefix of the streamed component files')
+    parser.add_argument('--output-dir', default='separated', help='folder for the outputs of a batch')
+    parser.add_argument('--n-jobs', type=int, default=1, help='worker processes for a batch (-1 for all cores)')
+    parser.add_argument('--n-components', type=int, default=None, help='number of sources (default: channels)')
+    parser.add_argument('--chunk-size', type=int, default=2**16, help='time points unmixed at a time')
+    parser.add_argument('--sample-size', type=int, default=200000, help='time points used to fit the unmixing')
+    args = parser.parse_args()
 
-ax1.plot(H[:,0],'k')
-ax2.plot(H[:,1],'k')
-f.suptitle('PCA components')
+    if args.manifest is not None:
+        recordings = read_manifest(args.manifest)
+        if not recordings:
+            parser.error('no recordings listed in {}'.format(args.manifest))
+        try:
+            recording_names(recordings)
+        except ValueError as error:
+            parser.error(str(error))
+        timings = separate_batch(recordings, args.output_dir, args.n_jobs,
+                                 n_components=args.n_components, chunk_size=args.chunk_size,
+                                 sample_size=args.sample_size, fun='exp')
+        write_timings(timings, os.path.join(args.output_dir, 'timings.csv'))
+        for timing in timings:
+            print('{recording}: {n_samples} samples in {total_time:.2f}s '
+                  '(fit {fit_time:.2f}s, unmix {unmix_time:.2f}s)'.format(**timing))
+    elif args.stream is not None:
+        separate_stream(args.stream, args.output, args.n_components, args.chunk_size, args.sample_size, fun='exp')
+    else:
+        demo()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Laplacian Eigenmaps for large datasets (see 5.3.Laplacian_Eigenmaps_solutions.ipynb).
+
+my_knn returns the k-nearest-neighbour graph as a scipy.sparse CSR matrix,
+found with a KD-tree (low-dimensional data, e.g. swiss rolls or the vertices of
+cortical surface meshes) or with blocked brute-force distances and np.argpartition.
+Memory grows with N*k rather than N*N, so graphs of 10^6 points fit in memory.
+
+my_laplacian_eigenmap can then keep the graph Laplacian sparse and find its
+smallest eigenvectors with ARPACK (shift-invert Lanczos) or LOBPCG, instead of
+the dense O(N^3) scipy.linalg.eigh.
+
+LaplacianEigenmap is the fitted version: it keeps the KD-tree of the training
+points, the embedding and the eigenvalues, and places new points into the
+existing embedding by the Nystrom extension, at the cost of one k-nearest-neighbour
+query and an O(k*d) weighted sum per point, without refitting:
+
+    model = LaplacianEigenmap(k=20, d=2).fit(X)
+    Z_new = model.transform(X_new)
+"""
+
+import numpy as np
+from scipy import sparse
+from scipy.linalg import eigh
+from scipy.sparse.linalg import eigsh, lobpcg
+from scipy.spatial import cKDTree
+
+
+def create_spiral(M, num_rotations):
+    """ Take 2D manifold M and output 3D spiral made from curling up M in 3D space """
+    N = M.shape[0]
+    r = np.exp(M[:,1] * num_rotations) * 0.5
+    theta = M[:,1] * (2 * np.pi) * num_rotations
+    X = np.zeros((N, 3))
+    X[:,0] = M[:,0] * 6
+    X[:,1] = r * np.cos(theta)
+    X[:,2] = r * np.sin(theta)
+    return X
+
+
+def knn_tree(X, k, block_size):
+    """ Indices (N, k) of the k nearest neighbours of every point (excluding itself),
+    from KD-tree queries of block_size points at a time """
+    N = X.shape[0]
+    tree = cKDTree(X)
+    neighbours = np.empty((N, k), dtype=np.intp)
+    for start in range(0, N, block_size):
+        rows = np.arange(start, min(start + block_size, N))
+        _, nearest = tree.query(X[rows], k + 1, workers=-1)
+        # drop the point itself; with duplicate points it may not come first
+        # (and if it is not returned at all, drop the farthest neighbour instead)
+        is_self = nearest == rows[:, None]
+        is_self[~is_self.any(axis=1), -1] = True
+        neighbours[rows] = nearest[~is_self].reshape(len(rows), k)
+    return neighbours
+
+
+def knn_brute(X, k, block_size):
+    """ Indices (N, k) of the k nearest neighbours of every point (excluding itself),
+    from the squared distances of block_size points at a time to all points """
+    N = X.shape[0]
+    sq_norms = np.sum(X**2, axis=1)
+    neighbours = np.empty((N, k), dtype=np.intp)
+    for start in range(0, N, block_size):
+        rows = np.arange(start, min(start + block_size, N))
+        # |x - y|^2 = |x|^2 - 2 x.y + |y|^2
+        sq_distances = sq_norms[rows, None] - 2 * X[rows] @ X.T + sq_norms
+        sq_distances[np.arange(len(rows)), rows] = np.inf
+        nearest = np.argpartition(sq_distances, k - 1, axis=1)[:, :k]
+        # sort the k nearest by distance, as np.argsort would
+        order = np.argsort(np.take_along_axis(sq_distances, nearest, axis=1), axis=1)
+        neighbours[rows] = np.take_along_axis(nearest, order, axis=1)
+    return neighbours
+
+
+def my_knn(X, k, method='auto', block_size=None):
+    """ Finds k-nearest neighbours in X
+
+    input:
+        X: data (N, D)
+        k: number of neighbours
+        method: 'tree' (KD-tree, best in low dimensions), 'brute' (blocked distances and
+                np.argpartition) or 'auto' (tree for D <= 16)
+        block_size: number of points processed at a time (bounds the memory of 'brute'
+                    to block_size*N distances); defaults to 65536 for 'tree' and
+                    about 2^25/N for 'brute'
+
+    output:
+        A: sparse CSR adjacency (N, N), A[i,j] = 1 if j is one of the k nearest neighbours of i
+    """
+    X = np.asarray(X, dtype=float)
+    N, D = X.shape
+    if method == 'auto':
+        method = 'tree' if D <= 16 else 'brute'
+    if method == 'tree':
+        neighbours = knn_tree(X, k, block_size or 65536)
+    elif method == 'brute':
+        neighbours = knn_brute(X, k, block_size or max(1, 2**25 // N))
+    else:
+        raise ValueError("method must be 'auto', 'tree' or 'brute', got {}".format(method))
+    neighbours.sort(axis=1)
+    indptr = np.arange(0, N * k + 1, k)
+    return sparse.csr_matrix((np.ones(N * k), neighbours.ravel(), indptr), shape=(N, N))
+
+
+def symmetrise(X):
+    """ Symmetrises the matrix X.
+
+    Notes
+    -----
+    the element-wise maximum of X and its transpose: X.maximum for sparse
+    matrices, np.maximum for dense arrays."""
+    if sparse.issparse(X):
+        return X.maximum(X.T).tocsr()
+    return np.maximum(X, X.T)
+
+
+def laplacian(A, normalised=False):
+    """ Graph Laplacian of a symmetric adjacency matrix A, kept sparse (CSR)
+
+    input:
+        A: symmetric adjacency (sparse or dense)
+        normalised: if True, the normalised Laplacian I - D^-1/2 A D^-1/2,
+                    otherwise L = D - A
+
+    output:
+        L: sparse CSR Laplacian
+        degree: degree of every node (the diagonal of D)
+    """
+    A = sparse.csr_matrix(A)
+    degree = np.asarray(A.sum(axis=0)).ravel()
+    if not normalised:
+        return (sparse.diags(degree) - A).tocsr(), degree
+    inv_sqrt = sparse.diags(1 / np.sqrt(degree))
+    return (sparse.identity(A.shape[0]) - inv_sqrt @ A @ inv_sqrt).tocsr(), degree
+
+
+def smallest_eigenvectors(L, d, solver='arpack', random_state=0):
+    """ Eigenvectors 1 to d (the d smallest after the constant one) of a sparse Laplacian
+
+    input:
+        L: sparse symmetric positive semi-definite Laplacian (N, N)
+        d: number of eigenvectors
+        solver: 'arpack' (shift-invert Lanczos around a small negative shift, so that
+                the factorised matrix is not singular) or 'lobpcg' (Jacobi preconditioned)
+        random_state: fixes the random starting vectors
+
+    output:
+        v: eigenvalues (d,)
+        U: eigenvectors (N, d)
+    """
+    N = L.shape[0]
+    rng = np.random.default_rng(random_state)
+    if solver == 'arpack':
+        v, U = eigsh(L.tocsc(), k=d + 1, sigma=-1e-5, which='LM', v0=rng.standard_normal(N))
+    elif solver == 'lobpcg':
+        preconditioner = sparse.diags(1 / L.diagonal())
+        v, U = lobpcg(L, rng.standard_normal((N, d + 1)), M=preconditioner, largest=False,
+                      tol=1e-8, maxiter=2000)
+    else:
+        raise ValueError("solver must be 'arpack' or 'lobpcg', got {}".format(solver))
+    order = np.argsort(v)
+    return v[order[1:]], U[:, order[1:]]
+
+
+def fix_signs(U):
+    """ Flips each eigenvector so that its largest-magnitude entry is positive, as the sign
+    returned by an eigensolver is arbitrary """
+    rows = np.argmax(np.abs(U), axis=0)
+    return U * np.sign(U[rows, np.arange(U.shape[1])])
+
+
+def spectral_embedding(A, d=2, mode='auto', normalised=False, solver='arpack'):
+    """ Eigenvalues and embedding of the graph with symmetric adjacency A
+    (see my_laplacian_eigenmap for the parameters) """
+    L, degree = laplacian(A, normalised)
+    if mode == 'auto':
+        mode = 'sparse' if A.shape[0] > 2000 else 'dense'
+    if mode == 'dense':
+        # subset_by_index=[1,d] returns the d smallest (above 0 - in this case indices 1 to d)
+        v, Z = eigh(L.toarray(), subset_by_index=[1, d])
+    elif mode == 'sparse':
+        v, Z = smallest_eigenvectors(L, d, solver)
+    else:
+        raise ValueError("mode must be 'auto', 'dense' or 'sparse', got {}".format(mode))
+    if normalised:
+        Z = Z / np.sqrt(degree)[:, None]
+    return v, fix_signs(Z)
+
+
+def my_laplacian_eigenmap(X, k=20, d=2, mode='auto', normalised=False, solver='arpack'):
+    """ Laplacian Eigenmap embedding of X
+
+    input:
+        X: data (N, D)
+        k: number of nearest neighbours of the graph
+        d: dimension of the embedding
+        mode: 'dense' (the Laplacian as a dense matrix, scipy.linalg.eigh), 'sparse'
+              (sparse Laplacian and smallest_eigenvectors) or 'auto' (sparse above 2000 points)
+        normalised: use the normalised Laplacian; the embedding is then D^-1/2 times its
+                    eigenvectors, i.e. the solution of L u = lambda D u
+        solver: sparse eigensolver, 'arpack' or 'lobpcg'
+
+    output:
+        Z: embedding (N, d), one eigenvector per column, signs fixed by fix_signs
+    """
+    # use function my_knn to return A, and symmetrise to make A symmetric
+    A = symmetrise(my_knn(X, k))
+    v, Z = spectral_embedding(A, d, mode, normalised, solver)
+    return Z
+
+
+class LaplacianEigenmap:
+    """ Laplacian Eigenmap fitted to training data, which embeds new points by the
+    Nystrom extension.
+
+    Each training point satisfies the eigenvector equation of its row of the graph:
+    z_i = sum_j A_ij z_j / (d_i - lambda) for L = D - A, and
+    z_i = sum_j A_ij z_j / (d_i (1 - lambda)) for the normalised Laplacian. A new point
+    is given the same equation with its k nearest training points as neighbours
+    (degree k), i.e. a scaled mean of their embeddings.
+
+    parameters:
+        k, d, mode, normalised, solver: see my_laplacian_eigenmap
+
+    attributes (after fit):
+        tree_: cKDTree of the training points
+        embedding_: embedding of the training points (N, d)
+        eigenvalues_: eigenvalues of the embedding's eigenvectors (d,)
+    """
+
+    def __init__(self, k=20, d=2, mode='auto', normalised=False, solver='arpack'):
+        self.k = k
+        self.d = d
+        self.mode = mode
+        self.normalised = normalised
+        self.solver = solver
+
+    def fit(self, X):
+        """ Build the kNN graph of X and its embedding """
+        X = np.asarray(X, dtype=float)
+        self.tree_ = cKDTree(X)
+        A = symmetrise(my_knn(X, self.k))
+        self.eigenvalues_, self.embedding_ = spectral_embedding(A, self.d, self.mode, self.normalised,
+                                                                self.solver)
+        return self
+
+    def fit_transform(self, X):
+        """ Fit to X and return the embedding of X """
+        return self.fit(X).embedding_
+
+    def transform(self, X):
+        """ Embed new points (M, D) into the fitted embedding, returning (M, d) """
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        _, neighbours = self.tree_.query(X, self.k, workers=-1)
+        neighbours = neighbours.reshape(len(X), self.k)
+        if self.normalised:
+            scale = 1 / (self.k * (1 - self.eigenvalues_))
+        else:
+            scale = 1 / (self.k - self.eigenvalues_)
+        return self.embedding_[neighbours].sum(axis=1) * scale
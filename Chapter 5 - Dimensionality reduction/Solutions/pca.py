@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PCA functions of 5.1.Principal_Component_Analysis_sol.ipynb, with two variants
+for large data matrices (e.g. 10^5 x 10^4 imaging features) of which only the
+first few components are wanted:
+
+randomized_pca computes the top-k components only, by randomized SVD (Halko,
+Martinsson and Tropp, 2011), and incremental_pca updates the components one
+mini-batch of samples at a time (Ross et al., 2008). Both read X in blocks of
+rows, so X can be memory-mapped, e.g. np.load('features.npy', mmap_mode='r'),
+and the centred matrix is never formed.
+"""
+
+import numpy as np
+
+
+def pca_from_covariance(X):
+
+    """
+    Function to estimate PCA from sample covariance matrix:
+
+    Input args:
+        X : data matrix with shape (n_samples, n_features)
+
+    Output args:
+        u : eigenvectors of the sample covariance matrix
+        d : eigenvalues of the sample covariance matrix
+        X : centered data
+    """
+    X_C = X - np.mean(X, axis=0)
+    S = (1/(X_C.shape[0]-1))*np.matmul(X_C.transpose(), X_C)
+    # the covariance is symmetric, so eigh returns real eigenvalues (in ascending order)
+    d, u = np.linalg.eigh(S)
+    idx = d.argsort()[::-1]
+    return u[:, idx], d[idx], X_C
+
+
+def pca_from_svd(X):
+
+    """
+    Function to estimate PCA through SVD
+
+    Input args:
+        X : data matrix with shape (n_samples, n_features)
+
+    Output args:
+        u : left singular vectors
+        d : singular values
+        v : right singular vectors
+        X : centered data
+    """
+    X_C = X - np.mean(X, axis=0)
+    u, d, v = np.linalg.svd(X_C, full_matrices=False)
+    return u, d, v, X_C
+
+
+def row_blocks(n_rows, block_size):
+    """ Slices of at most block_size rows covering n_rows """
+    return [slice(start, min(start + block_size, n_rows)) for start in range(0, n_rows, block_size)]
+
+
+def column_mean(X, block_size):
+    """ Mean of every column of X, summed block by block """
+    return sum(np.sum(X[rows], axis=0, dtype=float) for rows in row_blocks(X.shape[0], block_size)) / X.shape[0]
+
+
+def centred_matmul(X, X_mean, B, block_size):
+    """ (X - X_mean) @ B, block by block of rows of X """
+    return np.concatenate([(X[rows] - X_mean) @ B for rows in row_blocks(X.shape[0], block_size)])
+
+
+def centred_rmatmul(X, X_mean, Q, block_size):
+    """ (X - X_mean).T @ Q, block by block of rows of X """
+    return sum((X[rows] - X_mean).T @ Q[rows] for rows in row_blocks(X.shape[0], block_size))
+
+
+def randomized_pca(X, k, n_oversamples=10, n_iter=4, block_size=10000, random_state=0):
+
+    """
+    Function to estimate the first k principal components by randomized SVD:
+    the range of the centred data is captured by its product with k+n_oversamples
+    random vectors, refined by n_iter power iterations, and the SVD is taken of the
+    data projected onto that small subspace
+
+    Input args:
+        X : data matrix with shape (n_samples, n_features), can be memory-mapped
+        k : number of components
+        n_oversamples : extra random vectors, for accuracy
+        n_iter : number of power iterations, for accuracy when singular values decay slowly
+        block_size : number of rows of X read at a time
+        random_state : fixes the random vectors
+
+    Output args:
+        u : first k left singular vectors (n_samples, k)
+        d : first k singular values (the explained variance is d**2/(n_samples-1))
+        v : first k right singular vectors, i.e. principal components (k, n_features)
+        X_mean : mean of X, to centre data before projection onto v
+    """
+    rng = np.random.default_rng(random_state)
+    X_mean = column_mean(X, block_size)
+    n_random = min(k + n_oversamples, *X.shape)
+    # orthonormal basis Q of the range of (X - X_mean), by power iterations
+    Q = centred_matmul(X, X_mean, rng.standard_normal((X.shape[1], n_random)), block_size)
+    Q, _ = np.linalg.qr(Q)
+    for i in range(n_iter):
+        P, _ = np.linalg.qr(centred_rmatmul(X, X_mean, Q, block_size))
+        Q, _ = np.linalg.qr(centred_matmul(X, X_mean, P, block_size))
+    # SVD of the small matrix B = Q.T (X - X_mean)
+    B = centred_rmatmul(X, X_mean, Q, block_size).T
+    u_B, d, v = np.linalg.svd(B, full_matrices=False)
+    return (Q @ u_B)[:, :k], d[:k], v[:k], X_mean
+
+
+def top_singular(M, k):
+    """ First k singular values and right singular vectors of M, from the
+    eigendecomposition of the smaller of M M.T and M.T M (cheaper than a full SVD) """
+    if M.shape[0] <= M.shape[1]:
+        w, U = np.linalg.eigh(M @ M.T)
+        idx = w.argsort()[::-1][:k]
+        d = np.sqrt(np.maximum(w[idx], 0))
+        return d, (U[:, idx].T @ M) / np.where(d > 0, d, 1)[:, None]
+    w, V = np.linalg.eigh(M.T @ M)
+    idx = w.argsort()[::-1][:k]
+    return np.sqrt(np.maximum(w[idx], 0)), V[:, idx].T
+
+
+def incremental_pca(X, k, batch_size=500):
+
+    """
+    Function to estimate the first k principal components one mini-batch of samples
+    at a time: the SVD of each batch, stacked with the components (scaled by their
+    singular values) of the batches seen so far and a correction for the change of
+    the mean, gives the updated components
+
+    Input args:
+        X : data matrix with shape (n_samples, n_features), can be memory-mapped
+        k : number of components (at most batch_size)
+        batch_size : number of samples per mini-batch
+
+    Output args:
+        d : first k singular values (the explained variance is d**2/(n_samples-1))
+        v : first k right singular vectors, i.e. principal components (k, n_features)
+        X_mean : mean of X, to centre data before projection onto v
+    """
+    n_seen = 0
+    X_mean = np.zeros(X.shape[1])
+    d = np.zeros(0)
+    v = np.zeros((0, X.shape[1]))
+    for rows in row_blocks(X.shape[0], batch_size):
+        batch = np.asarray(X[rows], dtype=float)
+        n_batch = batch.shape[0]
+        batch_mean = batch.mean(axis=0)
+        n_total = n_seen + n_batch
+        stacked = np.vstack((d[:, None] * v,
+                             batch - batch_mean,
+                             np.sqrt(n_seen * n_batch / n_total) * (X_mean - batch_mean)))
+        d, v = top_singular(stacked, k)
+        X_mean = X_mean + (batch_mean - X_mean) * n_batch / n_total
+        n_seen = n_total
+    return d, v, X_mean
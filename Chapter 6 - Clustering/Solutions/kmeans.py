@@ -8,7 +8,521 @@ Created on Wed Apr 25 18:29:48 2018
 import numpy as np 
 import matplotlib.pyplot as plt
 
-def k_means_segmentation(image, m1, m2):
+# largest number of intensity levels for which k-means runs on the image histogram
+MAX_HISTOGRAM_LEVELS=65536
+# number of pixels binned or labelled at a time, which bounds the temporary index arrays
+BLOCK_PIXELS=2**20
+
+def assign_clusters(image, centroids):
+    
+    '''Assigns every pixel to the cluster with the closest centroid intensity.
+    
+    As intensities are scalars, the nearest centroid is found from the midpoints
+    between the sorted centroids, in a single pass over the image.
+    
+    input:
+        image: image to be segmented (any shape)
+        centroids: array of k cluster centroids
+    
+    output:
+        labels: int array the shape of image with the cluster index (0 to k-1) of each pixel
+    '''
+    order=np.argsort(centroids, kind='stable')
+    sorted_centroids=np.asarray(centroids, dtype=float)[order]
+    midpoints=(sorted_centroids[1:]+sorted_centroids[:-1])/2
+    # pixels exactly half way between two centroids go to the lower one
+    return order[np.searchsorted(midpoints, image, side='left')]
+
+def update_centroids(values, labels, centroids, weights=None):
+    
+    '''Moves each centroid to the mean intensity of its cluster, using weighted
+    np.bincount sums rather than one boolean mask per cluster. Empty clusters 
+    keep their previous centroid.
+    
+    input:
+        values: intensities being clustered (an image, or the levels of its histogram)
+        labels: cluster index of each value (from assign_clusters)
+        centroids: array of k current centroids
+        weights: optional number of pixels with each value (histogram counts)
+    
+    output:
+        new_centroids: array of k updated centroids
+        counts: number of pixels in each cluster
+    '''
+    k=len(centroids)
+    values=values.ravel()
+    labels=labels.ravel()
+    if weights is None:
+        counts=np.bincount(labels, minlength=k)
+        sums=np.bincount(labels, weights=values, minlength=k)
+    else:
+        counts=np.bincount(labels, weights=weights, minlength=k)
+        sums=np.bincount(labels, weights=weights*values, minlength=k)
+    new_centroids=np.asarray(centroids, dtype=float).copy()
+    filled=counts>0
+    new_centroids[filled]=sums[filled]/counts[filled]
+    return new_centroids, counts
+
+def intensity_histogram(image):
+    
+    '''Histogram of an integer-valued image with one bin per intensity level.
+    
+    input:
+        image: integer image
+    
+    output:
+        levels: the intensity levels from image.min() to image.max()
+        counts: number of pixels at each level
+    '''
+    low=int(image.min())
+    high=int(image.max())
+    return np.arange(low, high+1), level_counts(image, low, high)
+
+def level_counts(image, low, high):
+    
+    '''Number of pixels of an integer image at each level from low to high, binned
+    in blocks of BLOCK_PIXELS so the index arrays never cover the whole image'''
+    values=image.ravel()
+    counts=np.zeros(high-low+1, dtype=np.int64)
+    for start in range(0, values.size, BLOCK_PIXELS):
+        # offset by the lowest level, so the histogram spans low to high only
+        counts+=np.bincount(level_offsets(values[start:start+BLOCK_PIXELS], low), minlength=high-low+1)
+    return counts
+
+def level_offsets(values, low):
+    
+    '''Indices values-low of a block of integer pixels into the histogram levels
+    (the values themselves when low is 0 and they are unsigned)'''
+    if low==0 and values.dtype.kind=='u':
+        return values
+    return values.astype(np.intp)-low
+
+def use_histogram(image, histogram):
+    
+    '''Decides whether k_means_multiclass can run in the histogram domain: the image 
+    must be integer-valued with at most MAX_HISTOGRAM_LEVELS intensity levels.'''
+    if histogram is False:
+        return False
+    suitable=(np.issubdtype(image.dtype, np.integer) and image.size > 0 and
+              int(image.max())-int(image.min()) < MAX_HISTOGRAM_LEVELS)
+    if histogram is True and not suitable:
+        raise ValueError('histogram mode needs an integer image with at most {} intensity levels'
+                         .format(MAX_HISTOGRAM_LEVELS))
+    return suitable
+
+def kmeans_plusplus(values, k, weights=None, n_candidates=None, random_state=None):
+    
+    '''Greedy k-means++ seeding: the first centroid is a random value, and each further 
+    centroid is the best (lowest inertia) of n_candidates values drawn with probability 
+    proportional to the squared distance to the closest centroid chosen so far (times 
+    the pixel count of each value, for histogram levels).
+    
+    input:
+        values: intensities (e.g. a subsample of the image, or histogram levels)
+        k: number of clusters
+        weights: optional number of pixels with each value
+        n_candidates: values tried for each centroid, 2+log(k) by default
+        random_state: fixes random seed
+    
+    output:
+        centroids: sorted array of k initial centroids
+    '''
+    rng=np.random.default_rng(random_state)
+    values=np.asarray(values, dtype=float).ravel()
+    weights=np.ones(values.size) if weights is None else np.asarray(weights, dtype=float).ravel()
+    if n_candidates is None:
+        n_candidates=2+int(np.log(k))
+    centroids=[values[rng.choice(values.size, p=weights/np.sum(weights))]]
+    distances=np.square(values-centroids[0])
+    for i in range(1, k):
+        scores=weights*distances
+        total=np.sum(scores)
+        if total == 0:
+            # fewer distinct values than clusters: repeat the last centroid
+            centroids.append(centroids[-1])
+            continue
+        candidates=values[rng.choice(values.size, n_candidates, p=scores/total)]
+        candidate_distances=np.minimum(distances, np.square(values-candidates[:,None]))
+        best=np.argmin(candidate_distances@weights)
+        centroids.append(candidates[best])
+        distances=candidate_distances[best]
+    return np.sort(np.asarray(centroids))
+
+def histogram_peaks(levels, counts, k, smoothing=None):
+    
+    '''Histogram-peak seeding: the k highest local maxima of the smoothed intensity 
+    histogram, i.e. what one reads off the histogram when picking centroids by hand.
+    If the histogram has fewer than k peaks, the remaining centroids are placed at 
+    quantiles of the intensity distribution.
+    
+    input:
+        levels: intensity levels (bin centres)
+        counts: number of pixels at each level
+        k: number of clusters
+        smoothing: width (in bins) of the moving average applied first; 
+                   defaults to 1/64 of the number of levels
+    
+    output:
+        centroids: sorted array of k initial centroids
+    '''
+    levels=np.asarray(levels, dtype=float)
+    counts=np.asarray(counts, dtype=float)
+    if smoothing is None:
+        smoothing=max(1, len(levels)//64)
+    smooth=np.convolve(counts, np.ones(smoothing)/smoothing, mode='same')
+    # plateaus count once, at their first bin
+    padded=np.concatenate(([-np.inf], smooth, [-np.inf]))
+    peaks=np.flatnonzero((padded[1:-1] > padded[:-2]) & (padded[1:-1] >= padded[2:]))
+    peaks=peaks[np.argsort(smooth[peaks], kind='stable')[::-1][:k]]
+    centroids=list(levels[peaks])
+    if len(centroids) < k:
+        cdf=np.cumsum(counts)/np.sum(counts)
+        quantiles=(np.arange(k-len(centroids))+0.5)/(k-len(centroids))
+        centroids.extend(levels[np.minimum(np.searchsorted(cdf, quantiles), len(levels)-1)])
+    return np.sort(np.asarray(centroids))
+
+def seed_centroids(values, k, weights=None, init='kmeans++', n_init=10, random_state=None):
+    
+    '''Automatic initial centroids for k clusters, replacing hand-picked guesses.
+    
+    As k-means of intensities has several local minima, 'kmeans++' seeds are drawn 
+    n_init times and each is refined by k-means on values (cheap on histogram levels 
+    or a subsample); the refined centroids with the lowest inertia are returned.
+    
+    input:
+        values: intensities (a subsample of the image, or histogram levels)
+        k: number of clusters
+        weights: optional number of pixels with each value
+        init: 'kmeans++' (see kmeans_plusplus) or 'peaks' (see histogram_peaks; 
+              unweighted values are binned into a 256-bin histogram first)
+        n_init: number of 'kmeans++' seeds tried
+        random_state: fixes random seed of 'kmeans++'
+    
+    output:
+        centroids: sorted array of k initial centroids
+    '''
+    if init=='peaks':
+        if weights is None:
+            counts,edges=np.histogram(values, 256)
+            return histogram_peaks((edges[1:]+edges[:-1])/2, counts, k)
+        return histogram_peaks(values, weights, k)
+    if init!='kmeans++':
+        raise ValueError("init must be 'kmeans++' or 'peaks', got {}".format(init))
+    
+    rng=np.random.default_rng(random_state)
+    best_inertia=np.inf
+    for i in range(n_init):
+        seeds=kmeans_plusplus(values, k, weights, random_state=rng)
+        if n_init==1:
+            return seeds
+        labels,centroids,n_iter,telemetry=cluster_values(values, seeds, weights)
+        # inertia of the final assignment, after one more update
+        inertia=cluster_values(values, centroids, weights, max_iter=1)[3]['inertia'][0]
+        if inertia < best_inertia:
+            best_inertia=inertia
+            best=np.sort(centroids)
+    return best
+
+def reseed_empty(values, labels, centroids, counts, weights=None):
+    
+    '''Moves the centroids of empty clusters onto the values farthest from their 
+    assigned centroid, one per empty cluster, so no cluster stays empty
+    
+    output:
+        centroids: the updated centroids
+    '''
+    empty=np.flatnonzero(counts==0)
+    values=values.ravel()
+    distances=np.square(values-centroids[labels.ravel()])
+    if weights is not None:
+        distances[weights==0]=-1
+    farthest=np.argsort(distances, kind='stable')[::-1]
+    centroids=centroids.copy()
+    for cluster,index in zip(empty, farthest):
+        if distances[index] <= 0:
+            break
+        centroids[cluster]=values[index]
+    return centroids
+
+def cluster_values(values, centroids, weights=None, max_iter=100, tol=1e-4, callback=None):
+    
+    '''The k-means iterations of k_means_multiclass, on an array of intensities
+    (optionally weighted by pixel counts, for histogram levels).
+    
+    input:
+        values: intensities to be clustered (any shape)
+        centroids: array of k initial centroid guesses
+        weights: optional number of pixels with each value
+        max_iter, tol, callback: see k_means_multiclass
+    
+    Clusters left empty by an update are reseeded with reseed_empty, and the iterations
+    do not stop on an update that moved a centroid by reseeding. If the last update moved the centroids (max_iter
+    reached, or a reseed), the values are reassigned to the final centroids, so the
+    labels always match the centroids returned.
+    
+    output:
+        labels: cluster index (0 to k-1) of each value
+        centroids: final cluster centroids
+        n_iter: number of iterations run
+        telemetry: dict of arrays 'centroids' (n_iter,k), 'inertia' (n_iter,) and 'changed' (n_iter,)
+    '''
+    centroids=np.asarray(centroids, dtype=float)
+    # sum of squared intensities, from which the inertia of each iteration follows
+    # using only the cluster counts and sums
+    if weights is None:
+        n_pixels=values.size
+        sum_squares=np.sum(np.square(values, dtype=float))
+    else:
+        n_pixels=np.sum(weights)
+        sum_squares=np.sum(weights*np.square(values, dtype=float))
+    labels=None
+    telemetry={'centroids':[], 'inertia':[], 'changed':[]}
+    
+    for n_iter in range(1, max_iter+1):
+        new_labels=assign_clusters(values, centroids)
+        if labels is None:
+            changed=1.0
+        elif weights is None:
+            changed=np.count_nonzero(new_labels!=labels)/n_pixels
+        else:
+            changed=np.sum(weights[new_labels!=labels])/n_pixels
+        labels=new_labels
+        
+        new_centroids,counts=update_centroids(values, labels, centroids, weights)
+        # inertia of this assignment: sum over clusters of counts*c^2 - 2*c*sums + sum of squares
+        sums=new_centroids*counts
+        inertia=sum_squares-2*np.dot(centroids,sums)+np.dot(centroids*centroids,counts)
+        # an update only counts as a reseed if a centroid was moved: with fewer distinct
+        # values than clusters, reseed_empty cannot fill every empty cluster
+        reseeded=False
+        if np.any(counts==0):
+            moved=reseed_empty(values, labels, new_centroids, counts, weights)
+            reseeded=not np.array_equal(moved, new_centroids)
+            new_centroids=moved
+        shift=np.max(np.abs(new_centroids-centroids))
+        centroids=new_centroids
+        
+        telemetry['centroids'].append(centroids)
+        telemetry['inertia'].append(inertia)
+        telemetry['changed'].append(changed)
+        if callback is not None:
+            callback({'iteration':n_iter, 'centroids':centroids, 'inertia':inertia, 'changed':changed})
+        if not reseeded and (changed <= tol or shift <= tol):
+            break
+    
+    if reseeded or shift > tol:
+        labels=assign_clusters(values, centroids)
+    telemetry={key:np.asarray(value) for key,value in telemetry.items()}
+    return labels, centroids, n_iter, telemetry
+
+def k_means_multiclass(image, centroids, max_iter=100, tol=1e-4, histogram='auto', callback=None, 
+                       return_telemetry=False, init='kmeans++', n_init=10, random_state=None):
+    
+    '''k-means segmentation into any number of intensity classes:
+     
+     Alternates assignment of pixels to the closest centroid and update of the
+     centroids, until the fraction of pixels changing cluster, or the largest
+     centroid shift, falls below tol (or max_iter iterations have run).
+     
+     For integer images the algorithm can run on the intensity histogram instead
+     (at most 65,536 levels, weighted by their pixel counts), so the cost of each
+     iteration does not depend on the image size. Labels are mapped back to the 
+     image in one pass at the end, through a lookup table.
+    
+    input:
+        image: image (2D, 3D volume, ...) to be segmented
+        centroids: array of k initial centroid guesses, or the number of clusters k 
+                   to seed them automatically (see seed_centroids)
+        max_iter: maximum number of iterations
+        tol: convergence tolerance, applied both to the fraction of changed 
+             labels and to the centroid shift (in intensity units)
+        histogram: 'auto' to use the histogram domain whenever the image allows it,
+                   True to require it, False to cluster every pixel
+        callback: optional function called after every iteration with a dict of
+                  'iteration', 'centroids' (after the update), 'inertia' (sum of squared 
+                  distances of pixels to their assigned centroid) and 'changed' (fraction 
+                  of pixels that changed cluster); nothing is plotted or printed
+        return_telemetry: if True, also return the per-iteration values as arrays
+        init, n_init: seeding when centroids is a number (see seed_centroids)
+        random_state: fixes random seed of the seeding
+    
+    output:
+        seg: segmented image with labels 1 to k (uint16), in the order of the input centroids
+        centroids: final cluster centroids
+        n_iter: number of iterations run
+        telemetry: (if return_telemetry) dict of arrays 'centroids' (n_iter,k), 
+                   'inertia' (n_iter,) and 'changed' (n_iter,)
+    '''
+    image=np.asarray(image)
+    
+    if use_histogram(image, histogram):
+        levels,counts=intensity_histogram(image)
+        if np.ndim(centroids)==0:
+            centroids=seed_centroids(levels, centroids, counts, init, n_init, random_state)
+        labels,centroids,n_iter,telemetry=cluster_values(levels, centroids, counts, max_iter, tol, callback)
+        seg=label_lookup(image, levels, labels)
+    else:
+        if np.ndim(centroids)==0:
+            rng=np.random.default_rng(random_state)
+            sample=image.ravel()[rng.choice(image.size, min(image.size, 1000000), replace=False)]
+            centroids=seed_centroids(sample, centroids, None, init, n_init, rng)
+        labels,centroids,n_iter,telemetry=cluster_values(image, centroids, None, max_iter, tol, callback)
+        seg=(labels+1).astype(np.uint16)
+    
+    if return_telemetry:
+        return seg, centroids, n_iter, telemetry
+    return seg, centroids, n_iter
+
+def label_lookup(image, levels, labels):
+    
+    '''Maps the cluster index of each histogram level back to an integer image,
+    through a lookup table, in one pass
+    
+    output:
+        seg: segmented image with labels 1 to k (uint16)
+    '''
+    lut=(labels+1).astype(np.uint16)
+    low=int(levels[0])
+    values=image.ravel()
+    seg=np.empty(image.shape, dtype=np.uint16)
+    flat=seg.reshape(-1)
+    for start in range(0, values.size, BLOCK_PIXELS):
+        flat[start:start+BLOCK_PIXELS]=lut[level_offsets(values[start:start+BLOCK_PIXELS], low)]
+    return seg
+
+def tile_slices(n_rows, tile_rows):
+    
+    '''Slices of at most tile_rows rows (or slices of a volume) covering the first image axis'''
+    return [slice(start, min(start+tile_rows, n_rows)) for start in range(0, n_rows, tile_rows)]
+
+def streaming_histogram(image, tile_rows):
+    
+    '''As intensity_histogram, reading the (memory-mapped) integer image one tile at a time'''
+    if not np.issubdtype(image.dtype, np.integer):
+        raise ValueError('histogram mode needs an integer image with at most {} intensity levels'
+                         .format(MAX_HISTOGRAM_LEVELS))
+    tiles=tile_slices(image.shape[0], tile_rows)
+    low=min(int(image[tile].min()) for tile in tiles)
+    high=max(int(image[tile].max()) for tile in tiles)
+    if high-low >= MAX_HISTOGRAM_LEVELS:
+        raise ValueError('image has more than {} intensity levels'.format(MAX_HISTOGRAM_LEVELS))
+    counts=np.zeros(high-low+1, dtype=np.int64)
+    for tile in tiles:
+        counts+=level_counts(np.asarray(image[tile]), low, high)
+    return np.arange(low, high+1), counts
+
+def sample_pixels(image, n_samples, tile_rows, random_state=None):
+    
+    '''Random subsample of about n_samples pixel intensities, drawn tile by tile 
+    (in proportion to the tile size) so that only one tile is read at a time'''
+    rng=np.random.default_rng(random_state)
+    fraction=min(1.0, n_samples/image.size)
+    samples=[]
+    for tile in tile_slices(image.shape[0], tile_rows):
+        values=np.asarray(image[tile]).ravel()
+        n=rng.binomial(values.size, fraction)
+        samples.append(values[rng.choice(values.size, n, replace=False)])
+    return np.concatenate(samples)
+
+def minibatch_centroids(image, centroids, tile_rows, n_epochs=1):
+    
+    '''Mini-batch k-means: updates the centroids after every tile, moving each
+    centroid towards the tile's cluster mean with a step of (tile count)/(total count)
+    so far, i.e. each centroid is the running mean of every pixel assigned to it.
+    
+    output:
+        centroids: final cluster centroids
+        n_iter: number of tiles processed
+    '''
+    centroids=np.asarray(centroids, dtype=float).copy()
+    totals=np.zeros(len(centroids))
+    n_iter=0
+    for epoch in range(n_epochs):
+        for tile in tile_slices(image.shape[0], tile_rows):
+            values=np.asarray(image[tile])
+            labels=assign_clusters(values, centroids)
+            tile_means,counts=update_centroids(values, labels, centroids)
+            totals+=counts
+            filled=counts>0
+            centroids[filled]+=(counts[filled]/totals[filled])*(tile_means[filled]-centroids[filled])
+            n_iter+=1
+    return centroids, n_iter
+
+def k_means_tiled(image, centroids, output=None, tile_rows=256, fit='auto', sample_size=1000000,
+                  max_iter=100, tol=1e-4, random_state=None, init='kmeans++', n_init=10):
+    
+    '''Streaming k-means segmentation of images too large for memory:
+     
+     The centroids are first fitted while reading the image one tile (block of rows,
+     or of slices of a volume) at a time, then every tile is labelled and written 
+     straight to output. With memory-mapped image and output arrays, peak memory 
+     is bounded by the tile size rather than the image size.
+    
+    input:
+        image: image to be segmented, e.g. np.load(path, mmap_mode='r')
+        centroids: array of k initial centroid guesses, or the number of clusters k
+                   to seed them automatically (from the histogram or a subsample)
+        output: uint16 array the shape of image for the labels, e.g. from
+                np.lib.format.open_memmap; allocated in memory if None
+        tile_rows: number of rows (first axis) per tile
+        fit: how the centroids are fitted: 'histogram' (exact, integer images only, from
+             the streamed intensity histogram), 'subsample' (k-means on a random 
+             subsample of sample_size pixels), 'minibatch' (mini-batch updates, one per
+             tile) or 'auto' (histogram when possible, otherwise subsample)
+        sample_size: number of pixels sampled by the 'subsample' fit
+        max_iter, tol: see k_means_multiclass
+        random_state: fixes random seed of the 'subsample' fit and of the seeding
+        init, n_init: seeding when centroids is a number (see seed_centroids)
+    
+    output:
+        seg: output, with labels 1 to k
+        centroids: final cluster centroids
+        n_iter: number of iterations (tiles for 'minibatch') of the fit
+    '''
+    if fit=='auto':
+        integer=np.issubdtype(image.dtype, np.integer)
+        fit='histogram' if integer else 'subsample'
+        if integer:
+            try:
+                levels,counts=streaming_histogram(image, tile_rows)
+            except ValueError:
+                fit='subsample'
+    elif fit=='histogram':
+        levels,counts=streaming_histogram(image, tile_rows)
+    
+    # the subsample is drawn once (one pass over the tiles), for both seeding and fitting
+    sample=None
+    if np.ndim(centroids)==0:
+        if fit=='histogram':
+            centroids=seed_centroids(levels, centroids, counts, init, n_init, random_state)
+        else:
+            sample=sample_pixels(image, sample_size, tile_rows, random_state)
+            centroids=seed_centroids(sample, centroids, None, init, n_init, random_state)
+    
+    if fit=='histogram':
+        labels,centroids,n_iter,telemetry=cluster_values(levels, centroids, counts, max_iter, tol)
+    elif fit=='subsample':
+        if sample is None:
+            sample=sample_pixels(image, sample_size, tile_rows, random_state)
+        labels,centroids,n_iter,telemetry=cluster_values(sample, centroids, None, max_iter, tol)
+    elif fit=='minibatch':
+        centroids,n_iter=minibatch_centroids(image, centroids, tile_rows)
+    else:
+        raise ValueError("fit must be 'auto', 'histogram', 'subsample' or 'minibatch', got {}".format(fit))
+    
+    if output is None:
+        output=np.empty(image.shape, dtype=np.uint16)
+    for tile in tile_slices(image.shape[0], tile_rows):
+        if fit=='histogram':
+            # integer images are labelled through the lookup table of the histogram levels
+            output[tile]=label_lookup(np.asarray(image[tile]), levels, labels)
+        else:
+            output[tile]=assign_clusters(np.asarray(image[tile]), centroids)+1
+    if isinstance(output, np.memmap):
+        output.flush()
+    return output, centroids, n_iter
+
+def k_means_segmentation(image, m1, m2, display=True):
     
     '''k-means segmentation:
      
@@ -16,45 +530,29 @@ def k_means_segmentation(image, m1, m2):
      input parameters is the image to be segmented and the initial values the
      centroids of the two clusters m1 and m2. The output parameters are the
      segmented image (seg) with labels 1 and 2, and  final cluster centroids.
+     Runs k_means_multiclass with two centroids.
     
     input:
         image: image to be segmented
         m1:  initial centroid 1 guess
         m2:  initial centroid 2 guess    
+        display: if True print the centroids of every iteration and show the 
+                 final segmentation; set to False for batch (headless) use
     
     output:
         seg: segmented image
     '''
-   
-    #create seg image same size as image but initialised as zeros
-    seg=np.zeros(image.shape)
-    
     # cast data as 16 bit int
     image=image.astype(np.uint16)
-    seg=seg.astype(np.uint16)
-                       
-    # Run the agorithm in a for loop for 10 iterations.
-    for i in range(10):
-        # For each pixel in the image calculate intensity distance 
-        #d_k to each cluster centroid m_k: d_k(i)=(image(i)-m_k)^2
-        
-        d_1=(image-m1)**2;
-        d_2=(image-m2)**2;
-        # Calculate the segmentation seg by assigning each pixel to a cluster 
-        #with closer centroid:
-        
-        seg[d_1<d_2]=1
-        seg[d_2<d_1]=2
-        
-        # Update the centroids:
-   
-        m1=np.mean(image[seg==1]);
-        m2=np.mean(image[seg==2]);
-        
-        # display segmentation for this iteration
+    
+    def print_iteration(info):
+        print('for iter {} the new cluster means are {} and {}'.format(info['iteration']-1,*info['centroids']))
+    
+    seg,centroids,n_iter=k_means_multiclass(image, [m1,m2], callback=print_iteration if display else None)
+    
+    if display:
+        # display the final segmentation
         plt.imshow(seg)
         plt.show()
-        
-        print('for iter {} the new cluster means are {} and {}'.format(i,m1,m2))
        
-    return seg
\ No newline at end of file
+    return seg
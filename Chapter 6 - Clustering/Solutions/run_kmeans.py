@@ -4,35 +4,266 @@
 Created on Wed Apr 25 18:57:06 2018
 
 @author: emma
+
+k-means segmentation of TIFF images.
+
+With no arguments, segments datasets/Cells.tif and displays the image, its
+intensity distribution and the segmentation. Otherwise segments every given
+image (or every .tif/.tiff in the given directories) and writes, for each one,
+its labels (<name>_labels.npy) and per-iteration telemetry (<name>_telemetry.npz)
+to the output directory. <name> is the file name without extension, prefixed with
+its folders (relative to the folder common to all images) when two images share a
+name. Use --no-display to run without a display, e.g.:
+
+    python run_kmeans.py slides/ --centroids 150 240 --output-dir seg --no-display
+
+Images larger than memory can be segmented tile by tile with --tile-rows: .npy
+images are then memory-mapped and labels are written straight to a memory-mapped
+<name>_labels.npy, so memory use is bounded by the tile size, e.g.:
+
+    python run_kmeans.py slide.npy --centroids 150 240 --tile-rows 512 --fit subsample --no-display
+
+A whole cohort (glob patterns, directories or a --manifest listing one image per
+line) can be segmented in a pool of worker processes with --n-jobs. With
+--warm-start the initial centroids are first refined on pixels pooled from all
+images, and every image starts from that shared fit. A summary.csv of the final
+centroids, iterations and runtime of each image is written to the output directory:
+
+    python run_kmeans.py "cohort/*.tif" --centroids 150 240 --n-jobs 16 --warm-start --no-display
+
+Without --centroids, the initial centroids of --n-clusters classes are seeded
+automatically from each image (k-means++ or histogram peaks, see --init):
+
+    python run_kmeans.py "cohort/*.tif" --n-clusters 3 --init kmeans++ --n-jobs 16 --no-display
 """
 
+import argparse
+import csv
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import matplotlib.pyplot as plt
 import numpy as np
 import kmeans
 
 
-# load image using matplotlib
-I = plt.imread('datasets/Cells.tif')
+def find_images(inputs, manifest=None):
+    ''' List the image files given directly, matching glob patterns, found in the given
+        directories, or listed (one per line) in a manifest file '''
+    inputs = list(inputs)
+    if manifest is not None:
+        with open(manifest) as f:
+            inputs.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for pattern in ('*.tif', '*.tiff', '*.TIF', '*.TIFF', '*.npy'):
+                paths.extend(glob.glob(os.path.join(path, pattern)))
+        elif glob.has_magic(path):
+            paths.extend(glob.glob(path))
+        else:
+            paths.append(path)
+    return sorted(set(paths))
+
+
+def output_names(paths):
+    ''' Unique output name of every image: its file name without extension, or, for
+        images sharing a name, its path relative to the folder common to all images,
+        with separators and dots replaced by '_' (e.g. a/cells.tif -> a_cells_tif) '''
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    if len(set(stems)) == len(stems):
+        return stems
+    root = os.path.commonpath([os.path.abspath(os.path.dirname(path)) for path in paths])
+    names = []
+    for path, stem in zip(paths, stems):
+        if stems.count(stem) > 1:
+            stem = os.path.relpath(os.path.abspath(path), root).replace(os.sep, '_').replace('.', '_')
+        names.append(stem)
+    duplicates = sorted(name for name in set(names) if names.count(name) > 1)
+    if duplicates:
+        raise ValueError('images would overwrite each other\'s outputs: {}'.format(', '.join(duplicates)))
+    return names
+
+
+def open_image(path):
+    ''' Read an image file; .npy files are memory-mapped rather than loaded '''
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    return plt.imread(path)
+
+
+def segment_file(path, centroids, output_dir, max_iter=100, tol=1e-4, tile_rows=None, fit='auto', init='kmeans++',
+                 name=None):
+    ''' Segment one image file and save its labels and telemetry
+        input:
+            path: image file
+            centroids: initial centroid guesses, or the number of clusters to seed them automatically
+            output_dir: folder for the outputs
+            max_iter, tol: see kmeans.k_means_multiclass
+            tile_rows: if set, segment tile by tile with kmeans.k_means_tiled, writing the
+                       labels to a memory-mapped file (no telemetry is saved)
+            fit: centroid fitting of the tiled mode (see kmeans.k_means_tiled)
+            init: automatic seeding, 'kmeans++' or 'peaks' (see kmeans.seed_centroids)
+            name: name of the outputs, by default the file name without extension
+        output:
+            seg: segmented image
+            summary: dict of the final centroids, number of iterations, runtime and labels file
+    '''
+    start = time.perf_counter()
+    image = open_image(path)
+    if name is None:
+        name = os.path.splitext(os.path.basename(path))[0]
+    labels_path = os.path.join(output_dir, name + '_labels.npy')
+
+    if tile_rows is not None:
+        output = np.lib.format.open_memmap(labels_path, mode='w+', dtype=np.uint16, shape=image.shape)
+        seg, final_centroids, n_iter = kmeans.k_means_tiled(
+            image, centroids, output, tile_rows, fit=fit, max_iter=max_iter, tol=tol, init=init)
+    else:
+        seg, final_centroids, n_iter, telemetry = kmeans.k_means_multiclass(
+            np.asarray(image), centroids, max_iter=max_iter, tol=tol, return_telemetry=True, init=init)
+        np.save(labels_path, seg)
+        np.savez(os.path.join(output_dir, name + '_telemetry.npz'), **telemetry)
+    summary = {'image': path, 'centroids': final_centroids, 'iterations': n_iter,
+               'runtime': time.perf_counter() - start, 'labels': labels_path}
+    return seg, summary
+
+
+def shared_initial_fit(paths, centroids, sample_size=1000000, tile_rows=256, random_state=0, init='kmeans++'):
+    ''' Warm start for a batch: refine the initial centroids (seeded with init if
+        centroids is a number of clusters) by k-means on pixels sampled from every 
+        image (sample_size in total, split evenly)
+        output:
+            centroids: shared initial centroids
+    '''
+    per_image = max(1, sample_size//len(paths))
+    rng = np.random.default_rng(random_state)
+    sample = np.concatenate([kmeans.sample_pixels(open_image(path), per_image, tile_rows, rng) for path in paths])
+    if np.ndim(centroids) == 0:
+        centroids = kmeans.seed_centroids(sample, centroids, init=init, random_state=rng)
+    labels, centroids, n_iter, telemetry = kmeans.cluster_values(sample, centroids)
+    return centroids
+
+
+def segment_task(path, centroids, output_dir, max_iter, tol, tile_rows, fit, init, name):
+    ''' Worker task of segment_batch: segment one image and return its summary only '''
+    plt.switch_backend('Agg')
+    seg, summary = segment_file(path, centroids, output_dir, max_iter, tol, tile_rows, fit, init, name)
+    return summary
+
+
+def segment_batch(paths, centroids, output_dir, n_jobs=1, warm_start=False, max_iter=100, tol=1e-4,
+                  tile_rows=None, fit='auto', init='kmeans++'):
+    ''' Segment many images in a pool of worker processes, saving the labels of each
+        input:
+            paths: image files
+            centroids: initial centroid guesses, or the number of clusters to seed them automatically
+            output_dir: folder for the outputs
+            n_jobs: number of worker processes (-1 for all cores)
+            warm_start: if True, start every image from shared_initial_fit
+            max_iter, tol, tile_rows, fit, init: see segment_file
+        output:
+            summaries: list of dicts (see segment_file), in the order of paths
+    '''
+    if not paths:
+        raise ValueError('no images to segment')
+    names = output_names(paths)
+    if warm_start:
+        centroids = shared_initial_fit(paths, centroids, init=init)
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    n = len(paths)
+    task_args = (paths, [centroids]*n, [output_dir]*n, [max_iter]*n, [tol]*n, [tile_rows]*n, [fit]*n, [init]*n, names)
+    if n_jobs == 1:
+        return list(map(segment_task, *task_args))
+    with ProcessPoolExecutor(min(n_jobs, n)) as pool:
+        return list(pool.map(segment_task, *task_args))
+
+
+def write_summary(summaries, path):
+    ''' Write the final centroids, iterations and runtime of every image to a CSV file '''
+    k = max(len(summary['centroids']) for summary in summaries)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['image', 'iterations', 'runtime'] + ['centroid_{}'.format(i+1) for i in range(k)])
+        for summary in summaries:
+            writer.writerow([summary['image'], summary['iterations'], '{:.6f}'.format(summary['runtime'])]
+                            + list(summary['centroids']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='k-means intensity segmentation of TIFF images')
+    parser.add_argument('inputs', nargs='*', help='image files, glob patterns or directories of .tif/.tiff images')
+    parser.add_argument('--manifest', default=None, help='text file listing one image per line')
+    parser.add_argument('--centroids', type=float, nargs='+', default=None,
+                        help='initial centroid guesses, one per class (seeded automatically if omitted)')
+    parser.add_argument('--n-clusters', type=int, default=2, help='number of classes seeded without --centroids')
+    parser.add_argument('--init', default='kmeans++', choices=['kmeans++', 'peaks'],
+                        help='automatic seeding: k-means++ or intensity histogram peaks')
+    parser.add_argument('--output-dir', default='segmentations', help='folder for labels and telemetry')
+    parser.add_argument('--max-iter', type=int, default=100)
+    parser.add_argument('--tol', type=float, default=1e-4)
+    parser.add_argument('--no-display', action='store_true', help='do not plot (headless batch runs)')
+    parser.add_argument('--tile-rows', type=int, default=None,
+                        help='segment images tile by tile, this many rows at a time (bounded memory)')
+    parser.add_argument('--fit', default='auto', choices=['auto', 'histogram', 'subsample', 'minibatch'],
+                        help='centroid fitting in tiled mode')
+    parser.add_argument('--n-jobs', type=int, default=1, help='worker processes for batches (-1 for all cores)')
+    parser.add_argument('--warm-start', action='store_true',
+                        help='start every image from a shared fit on pixels pooled from all images')
+    args = parser.parse_args()
+
+    if args.no_display:
+        plt.switch_backend('Agg')
+
+    if not args.inputs and args.manifest is None:
+        # load image using matplotlib
+        I = plt.imread('datasets/Cells.tif')
 
-print(I)
-#display image
+        #display image
+        if not args.no_display:
+            plt.imshow(I)
+            plt.show()
 
-plt.imshow(I)
-plt.show()
+            plt.hist(np.reshape(I,(I.shape[0]*I.shape[1])),25)
+            plt.title('Intensity distribution')
+            plt.xlabel('Intensity')
+            plt.ylabel('Frequency')
+            plt.show()
 
-plt.hist(np.reshape(I,(I.shape[0]*I.shape[1])),25)
-plt.title('Intensity distribution')
-plt.xlabel('Intensity')
-plt.ylabel('Frequency')
-plt.show()
+        # make guesses for cluster intensities (pick cluster centres from histogram)
+        if args.centroids is None:
+            levels, counts = kmeans.intensity_histogram(I.astype(np.uint16))
+            m1, m2 = kmeans.seed_centroids(levels, 2, counts, init=args.init)
+        else:
+            m1, m2 = args.centroids[:2]
 
-# make guesses for cluster intensities (pick cluster centres from histogram)
-m1=150
-m2=240
+        print('initial guesses for cluster centroids:', m1,m2,I.shape)
+        # apply k_means function
+        return kmeans.k_means_segmentation(I,m1,m2,display=not args.no_display)
 
-print('initial guesses for cluster centroids:', m1,m2,I.shape)
-if m1 is not None and m2 is not None:
-    # apply k_means function 
-    seg=kmeans.k_means_segmentation(I,m1,m2)
+    os.makedirs(args.output_dir, exist_ok=True)
+    paths = find_images(args.inputs, args.manifest)
+    if not paths:
+        parser.error('no images found in the given inputs or manifest')
+    try:
+        output_names(paths)
+    except ValueError as error:
+        parser.error(str(error))
+    centroids = args.n_clusters if args.centroids is None else args.centroids
+    summaries = segment_batch(paths, centroids, args.output_dir, args.n_jobs, args.warm_start,
+                              args.max_iter, args.tol, args.tile_rows, args.fit, args.init)
+    write_summary(summaries, os.path.join(args.output_dir, 'summary.csv'))
+    for summary in summaries:
+        print('{}: {} iterations in {:.3f}s, centroids {}'.format(
+            summary['image'], summary['iterations'], summary['runtime'], np.round(summary['centroids'], 2)))
+        if not args.no_display:
+            plt.imshow(np.load(summary['labels']))
+            plt.title(summary['image'])
+            plt.show()
 
 
+if __name__ == '__main__':
+    seg = main()
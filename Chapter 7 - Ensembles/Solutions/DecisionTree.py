@@ -8,7 +8,6 @@ Decision Tree Predictor, using gini coefficient as cost
 @author: E Robinson
 """
 import numpy as np
-from  copy import deepcopy 
 import sys
 
 def gini_coefficient(class_membership):
@@ -102,6 +101,246 @@ def test_split(index, value, dataset):
 	
     return np.asarray(left), np.asarray(right)
 
+def split_costs(feature, class_ids, n_classes):
+    """
+        Estimates the cost of every candidate threshold of one feature in a single sorted sweep
+        input:
+            feature = array (n_samples,) of values of one feature/attribute; each value is
+                      trialled as a threshold, exactly as in get_best_split
+            class_ids = int array (n_samples,) giving the position of each sample's class
+                        in the sorted list of class values
+            n_classes = total number of classes
+                             
+        output:
+            costs: array (n_samples,) where costs[i] is split_cost for the threshold feature[i]
+    """
+    n_samples=feature.shape[0]
+    # sort the feature once; the stable sort keeps tied values in their original row order
+    order=np.argsort(feature, kind='stable')
+    sorted_feature=feature[order]
+    
+    # cumulative class counts: row p holds the class counts of the p smallest samples
+    cumulative=np.zeros((n_samples+1,n_classes), dtype=np.int64)
+    cumulative[np.arange(1,n_samples+1), class_ids[order]]=1
+    np.cumsum(cumulative, axis=0, out=cumulative)
+    
+    # everything strictly below a threshold goes left, so the left branch of each
+    # threshold ends at the first occurrence of that value in the sorted feature 
+    left_size=np.searchsorted(sorted_feature, sorted_feature, side='left')
+    left_counts=cumulative[left_size]
+    right_counts=cumulative[-1]-left_counts
+    
+    costs=np.empty(n_samples)
+    costs[order]=gini_split_costs(left_counts, right_counts)
+    return costs
+
+def gini_split_costs(left_counts, right_counts):
+    """
+        Estimates split_cost for many proposed splits at once
+        input:
+            left_counts, right_counts: int arrays (..., k) of the class counts of the
+                                       left and right branch of each proposed split
+                             
+        output:
+            costs: array (...) of the weighted gini coefficient of each split
+    """
+    left_size=left_counts.sum(axis=-1)
+    right_size=right_counts.sum(axis=-1)
+    total_samples=left_size+right_size
+    
+    # gini coefficient of each branch, accumulated in the same order as gini_coefficient;
+    # an empty branch keeps gini=1 but has zero weight
+    gini_left=np.ones(left_size.shape)
+    gini_right=np.ones(right_size.shape)
+    left_total=np.maximum(left_size,1)
+    right_total=np.maximum(right_size,1)
+    for k in range(left_counts.shape[-1]):
+        gini_left-=(left_counts[...,k]/left_total)*(left_counts[...,k]/left_total)
+        gini_right-=(right_counts[...,k]/right_total)*(right_counts[...,k]/right_total)
+    
+    return gini_left*(left_size/total_samples)+gini_right*(right_size/total_samples)
+
+def variance_split_costs(feature, targets):
+    """
+        Regression version of split_costs: estimates the cost of every candidate threshold 
+        of one feature from running sums and sums of squares, in a single sorted sweep
+        input:
+            feature = array (n_samples,) of values of one feature/attribute
+            targets = array (n_samples,) of the (continuous) target of each sample
+                             
+        output:
+            costs: array (n_samples,) where costs[i] is the cost of the threshold feature[i]
+    """
+    n_samples=feature.shape[0]
+    order=np.argsort(feature, kind='stable')
+    sorted_feature=feature[order]
+    sorted_targets=targets[order]
+    
+    # running count, sum and sum of squares of the p smallest samples
+    cumulative=np.zeros((n_samples+1,3))
+    cumulative[1:,0]=1
+    cumulative[1:,1]=sorted_targets
+    cumulative[1:,2]=sorted_targets*sorted_targets
+    np.cumsum(cumulative, axis=0, out=cumulative)
+    
+    left_size=np.searchsorted(sorted_feature, sorted_feature, side='left')
+    left_stats=cumulative[left_size]
+    right_stats=cumulative[-1]-left_stats
+    
+    costs=np.empty(n_samples)
+    costs[order]=variance_costs(left_stats, right_stats)
+    return costs
+
+def variance_costs(left_stats, right_stats):
+    """
+        Estimates the cost of many proposed splits of a regression tree at once
+        input:
+            left_stats, right_stats: arrays (..., 3) of the number of samples, the sum of the 
+                                     targets and the sum of squared targets of each branch
+                             
+        output:
+            costs: array (...) of the variance of each branch, weighted by branch size 
+                   (the mean squared error of predicting each branch by its mean)
+    """
+    total_samples=left_stats[...,0]+right_stats[...,0]
+    # sum of squared deviations from the branch mean; zero for an empty branch
+    sse_left=left_stats[...,2]-left_stats[...,1]*left_stats[...,1]/np.maximum(left_stats[...,0],1)
+    sse_right=right_stats[...,2]-right_stats[...,1]*right_stats[...,1]/np.maximum(right_stats[...,0],1)
+    return (sse_left+sse_right)/total_samples
+
+def best_threshold(data, rows, targets, n_classes, criterion='gini', features=None):
+    """
+        Search through all attributes and all possible thresholds for the lowest cost split
+        input:
+            data = array (n_samples,n_features+1), last column indicates class membership
+            rows = int array of the rows of data reaching this node (None for all rows)
+            targets = for criterion 'gini', int array giving the class position of each of 
+                      these rows; for 'variance', their target values
+            n_classes = total number of classes
+            criterion = 'gini' (classification) or 'variance' (regression)
+            features = sorted int array of the features to search (None for all features)
+                             
+        output:
+            best_index, best_value: feature index and threshold value of the optimal split
+            
+        Each feature is scored in one vectorised pass by split_costs. Ties are broken 
+        as in a row by row search: the first feature, then the first row, with the lowest cost.
+    """
+    # initalising optimal values prior to refinment
+    best_cost=sys.float_info.max # initialise to max float
+    best_index=data.shape[1]+1 # initialise as greater than total number of features
+    best_row=0
+
+    if features is None:
+        features=np.arange(data.shape[1]-1)
+
+    #iterating over all features/attributes (columns of dataset)
+    for index in features:
+        feature=data[:,index] if rows is None else data[rows,index]
+        # scoring the splits defined by each row value for this attribute
+        if criterion=='gini':
+            costs=split_costs(feature, targets, n_classes)
+        else:
+            costs=variance_split_costs(feature, targets)
+        r_index=np.argmin(costs)
+        if costs[r_index] < best_cost:
+            best_cost=costs[r_index]
+            best_index=index
+            best_row=r_index if rows is None else rows[r_index]
+    
+    return best_index, data[best_row,best_index]
+
+def quantize_features(data, max_bins=256):
+    """
+        Quantize each feature once into at most max_bins bins, for histogram-based split finding
+        input:
+            data = array (n_samples,n_features+1), last column indicates class membership
+            max_bins = maximum number of bins per feature (2 to 256)
+                             
+        output:
+            binned: uint8 array (n_samples,n_features) of the bin of each value
+            thresholds: array (n_features,max_bins); thresholds[f,b] is the split value 
+                        that sends bins below b to the left branch (nothing goes left for b=0)
+            n_bins: int array (n_features,) of the number of bins used by each feature
+    """
+    if max_bins < 2 or max_bins > 256:
+        raise ValueError('max_bins must be between 2 and 256, got {}'.format(max_bins))
+    n_features=data.shape[1]-1
+    binned=np.empty((data.shape[0],n_features), dtype=np.uint8)
+    thresholds=np.full((n_features,max_bins), np.inf)
+    n_bins=np.empty(n_features, dtype=np.intp)
+    
+    for index in range(n_features):
+        feature=data[:,index]
+        values=np.unique(feature)
+        if values.shape[0] <= max_bins:
+            # few distinct values: every value gets its own bin, as in exact splitting
+            edges=values[1:]
+        else:
+            # otherwise bin edges are (distinct) data values at evenly spaced quantiles
+            edges=np.unique(np.quantile(values, np.linspace(0,1,max_bins+1)[1:-1], method='lower'))
+        # a value falls in bin b when exactly b edges are less than or equal to it
+        binned[:,index]=np.searchsorted(edges, feature, side='right')
+        thresholds[index,0]=values[0]
+        thresholds[index,1:edges.shape[0]+1]=edges
+        n_bins[index]=edges.shape[0]+1
+        
+    return binned, thresholds, n_bins
+
+def node_histogram(workspace, rows):
+    """
+        Counts the classes of the given rows in every bin of every feature
+        output:
+            histogram: int array (n_features,max_bins,n_classes); for regression trees
+                       (criterion 'variance') an array (n_features,max_bins,3) of the number 
+                       of rows, sum of targets and sum of squared targets in each bin
+    """
+    binned=workspace['binned'][rows]
+    targets=workspace['targets'][rows]
+    n_features,max_bins=workspace['thresholds'].shape
+    if workspace['criterion']=='variance':
+        # flat position of (feature, bin) for every value of the node
+        flat=(np.arange(n_features)*max_bins+binned).ravel()
+        weights=np.broadcast_to(targets[:,None], binned.shape).ravel()
+        stats=[np.bincount(flat, minlength=n_features*max_bins),
+               np.bincount(flat, weights=weights, minlength=n_features*max_bins),
+               np.bincount(flat, weights=weights*weights, minlength=n_features*max_bins)]
+        return np.stack(stats, axis=-1).reshape((n_features,max_bins,3))
+    
+    n_classes=workspace['n_classes']
+    # flat position of (feature, bin, class) for every value of the node 
+    flat=(np.arange(n_features)*max_bins+binned)*n_classes+targets[:,None]
+    counts=np.bincount(flat.ravel(), minlength=n_features*max_bins*n_classes)
+    return counts.reshape((n_features,max_bins,n_classes))
+
+def best_histogram_split(histogram, n_bins, criterion='gini', features=None):
+    """
+        Search all features and bin boundaries of a node histogram for the lowest cost split
+        input:
+            histogram = array (n_features,max_bins,n_classes) from node_histogram
+            n_bins = number of bins used by each feature
+            criterion = 'gini' (classification) or 'variance' (regression)
+            features = int array of the features to search (None for all features)
+                             
+        output:
+            best_index, best_bin: the optimal split sends bins below best_bin of feature best_index left
+    """
+    # class counts of everything in bins strictly below each bin
+    left_counts=np.cumsum(histogram, axis=1)-histogram
+    right_counts=histogram.sum(axis=1, keepdims=True)-left_counts
+    if criterion=='gini':
+        costs=gini_split_costs(left_counts, right_counts)
+    else:
+        costs=variance_costs(left_counts, right_counts)
+    # bins that are not used by a feature are not candidate splits
+    costs[np.arange(histogram.shape[1]) >= n_bins[:,None]]=np.inf
+    if features is not None:
+        searched=np.zeros(histogram.shape[0], dtype=bool)
+        searched[features]=True
+        costs[~searched]=np.inf
+    best_index,best_bin=np.unravel_index(np.argmin(costs), costs.shape)
+    return best_index, best_bin
+
 def get_best_split(dataset):
     """
         Search through all attributes and all possible thresholds to find the best split for the data
@@ -117,30 +356,70 @@ def get_best_split(dataset):
                              3) 'branches': tuple of data arrays reflecting the optimal split into left and right branches
                              
     """
-    class_values=np.unique(dataset[:,-1])
-    # initalising optimal values prior to refinment
-    best_cost=sys.float_info.max # initialise to max float
-    best_value=sys.float_info.max # initialise to max float
-    best_index=dataset.shape[1]+1 # initialise as greater than total number of features
-    best_split=tuple() # the best_split variable should contain the output of test_split that corresponds to the optimal cost
-
-    #iterating over all features/attributes (columns of dataset)
-    for index in np.arange(dataset.shape[1]-1):
-
-        #Trialling splits defined by each row value for this attribute
-        for r_index,row in enumerate(dataset):
-            branches=test_split(index, row[index], dataset)
-
-            cost=split_cost(branches,class_values)
-            if cost < best_cost:
-                best_cost=cost
-                best_split=branches
-                best_index=index
-                best_value=row[index]
-                #print('Best cost={}; Best feature={}; Best row={}'.format(best_cost,index,r_index) )
+    class_values,class_ids=np.unique(dataset[:,-1], return_inverse=True)
+    best_index,best_value=best_threshold(dataset, None, class_ids, class_values.shape[0])
+    
+    mask=dataset[:,best_index] < best_value
+    best_split=(dataset[mask], dataset[~mask])
                 
     return {'index':best_index, 'value':best_value, 'branches':best_split}
 
+def get_best_split_indexed(workspace, start, stop, histogram=None):
+    """
+        As get_best_split, but for a node holding the rows order[start:stop] of a shared training array.
+        The rows of the node are partitioned in place, so that the left branch 
+        holds order[start:mid] and the right branch order[mid:stop]
+        input:
+            workspace = dict created by build_tree containing: 1) 'data': the training array
+                                                               2) 'order': permutation buffer of row indices
+                                                               3) 'criterion': 'gini' or 'variance'
+                                                               4) 'targets': class position (gini) or 
+                                                                  centred target value (variance) of every row
+                                                               5) 'n_classes': total number of classes
+                                                               6) 'max_features': number of features searched at 
+                                                                  each node (None for all), drawn with 'rng'
+                        and, for binned trees, the output of quantize_features ('binned', 'thresholds', 'n_bins')
+            start, stop = range of order reaching this node
+            histogram = for binned trees, the node_histogram of the node
+                             
+        output:
+            dict containing: 1) 'index' : index of feature used for splittling on
+                             2)  'value': value of threshold split on
+                             3) 'branches': tuple (start, mid, stop) of index ranges into order; 
+                                for binned trees followed by the histograms of both branches
+    """
+    data,order=workspace['data'],workspace['order']
+    rows=order[start:stop]
+    features=None
+    if workspace['max_features'] is not None:
+        # random subspace: only a random subset of the features is searched at this node
+        n_features=data.shape[1]-1
+        features=np.sort(workspace['rng'].choice(n_features, workspace['max_features'], replace=False))
+    if histogram is None:
+        best_index,best_value=best_threshold(data, rows, workspace['targets'][rows], 
+                                             workspace['n_classes'], workspace['criterion'], features)
+        mask=data[rows,best_index] < best_value
+    else:
+        best_index,best_bin=best_histogram_split(histogram, workspace['n_bins'], workspace['criterion'], features)
+        best_value=workspace['thresholds'][best_index,best_bin]
+        mask=workspace['binned'][rows,best_index] < best_bin
+    
+    # stable partition, so that children see their rows in the same order as in get_best_split
+    mid=start+np.count_nonzero(mask)
+    order[start:stop]=np.concatenate((rows[mask], rows[~mask]))
+    branches=(start, mid, stop)
+    
+    if histogram is not None:
+        # only the smaller branch is counted, the sibling histogram is the remainder of the parent
+        if mid-start <= stop-mid:
+            left_histogram=node_histogram(workspace, order[start:mid])
+            branches+=(left_histogram, histogram-left_histogram)
+        else:
+            right_histogram=node_histogram(workspace, order[mid:stop])
+            branches+=(histogram-right_histogram, right_histogram)
+    
+    return {'index':best_index, 'value':best_value, 'branches':branches}
+
 
 # Create a terminal node value
 def to_terminal(group):
@@ -205,7 +484,73 @@ def run_split(node, max_depth, min_size, depth):
         node['right'] = get_best_split(right)
         run_split(node['right'], max_depth, min_size, depth+1)
         
-def build_tree(train, max_depth=None, min_size=1):
+def to_terminal_indexed(workspace, start, stop):
+    """
+        As to_terminal, for the rows order[start:stop] of the shared training array.
+        Regression trees (criterion 'variance') output the mean target of the rows.
+    """
+    outcomes = workspace['data'][workspace['order'][start:stop],-1]
+    if workspace['criterion']=='variance':
+        return np.mean(outcomes)
+    counts = np.bincount(outcomes.astype(int))
+    return np.argmax(counts)
+
+def run_split_indexed(node, workspace, max_depth, min_size, depth):
+     
+    """
+        As run_split, for nodes whose 'branches' are index ranges into workspace['order'] 
+        (see get_best_split_indexed), so no rows of the training data are copied
+    """
+    start, mid, stop = node['branches'][:3]
+    left_histogram, right_histogram = node['branches'][3:] or (None, None)
+    del(node['branches'])
+    # check for whether all data has been assigned to one branch; if so assign both branches the same label
+    if mid==start :
+        node['left'] = node['right'] = to_terminal_indexed(workspace, mid, stop)       
+        return
+    if mid==stop :
+        node['left'] = node['right'] = to_terminal_indexed(workspace, start, mid)       
+        return
+    # check for max depth; if exceeded then estimate labels for both branches
+    if max_depth != None and depth >= max_depth:
+        node['left'] = to_terminal_indexed(workspace, start, mid)
+        node['right'] = to_terminal_indexed(workspace, mid, stop)
+        return
+    # process left child
+    if mid-start <= min_size:
+        node['left'] = to_terminal_indexed(workspace, start, mid)
+    else:
+        node['left'] = get_best_split_indexed(workspace, start, mid, left_histogram)
+        run_split_indexed(node['left'], workspace, max_depth, min_size, depth+1)
+    
+    # process right child as for left
+    if stop-mid <= min_size:
+        node['right'] = to_terminal_indexed(workspace, mid, stop)
+    else:
+        node['right'] = get_best_split_indexed(workspace, mid, stop, right_histogram)
+        run_split_indexed(node['right'], workspace, max_depth, min_size, depth+1)
+        
+def n_split_features(max_features, n_features):
+    """
+    Converts the max_features argument of build_tree into a number of features
+    (None when all features are searched)
+    """
+    if max_features is None:
+        return None
+    if max_features=='sqrt':
+        n=int(np.sqrt(n_features))
+    elif max_features=='log2':
+        n=int(np.log2(n_features))
+    elif isinstance(max_features, (float, np.floating)):
+        n=int(max_features*n_features)
+    else:
+        n=int(max_features)
+    if n < 1 or n > n_features:
+        raise ValueError('max_features={} gives {} of {} features'.format(max_features, n, n_features))
+    return None if n==n_features else n
+
+def build_tree(train, max_depth=None, min_size=1, in_place=False, max_bins=None, rows=None, criterion='gini',
+               max_features=None, random_state=None):
     """
     Builds and returns final decision tree
     
@@ -213,7 +558,49 @@ def build_tree(train, max_depth=None, min_size=1):
         train : training data array (n_samples,n_features)
         max_depth: user defined max tree depth (int)
         min_size: user defined minimum number of examples per tree tree depth (int)
+        in_place: if True, nodes only keep index ranges into a single permutation buffer of 
+                  the rows of train, which is partitioned in place as the tree grows, instead
+                  of copies of their data. Memory then stays bounded for deep trees; the tree 
+                  returned is the same.
+        max_bins: if set (2 to 256), features are quantized once into at most max_bins bins
+                  and splits are found from per-node class histograms (see quantize_features).
+                  Only bin edges are trialled as thresholds, so large datasets train much
+                  faster at a small cost in accuracy. Binned trees are always built in place.
+        rows: optional int array of the rows of train to build the tree on (may contain 
+              repeats, e.g. a bootstrap sample). The tree is the same as for train[rows],
+              but is built in place, without copying those rows.
+        criterion: 'gini' for a classification tree, or 'variance' for a regression tree of 
+                   a continuous target (last column of train), which minimises the variance 
+                   of the targets in each branch and predicts the mean target of each leaf. 
+                   Regression trees are always built in place.
+        max_features: number of features searched at each node, drawn at random for every
+                      node as in a random forest: an int, a fraction of the features (float),
+                      'sqrt', 'log2', or None to search all features. Trees with 
+                      max_features are always built in place.
+        random_state: seed (or numpy random Generator) for drawing the features of each node
     """
+    if criterion not in ('gini', 'variance'):
+        raise ValueError("criterion must be 'gini' or 'variance', got {}".format(criterion))
+    max_features=n_split_features(max_features, train.shape[1]-1)
+    if in_place or max_bins is not None or rows is not None or criterion!='gini' or max_features is not None:
+        order=np.arange(train.shape[0]) if rows is None else np.array(rows, dtype=np.intp)
+        workspace={'data':train, 'order':order, 'criterion':criterion,
+                   'max_features':max_features, 'rng':np.random.default_rng(random_state)}
+        if criterion=='gini':
+            class_values,workspace['targets']=np.unique(train[:,-1], return_inverse=True)
+            workspace['n_classes']=class_values.shape[0]
+        else:
+            # centring the targets keeps the running sums of squares accurate
+            workspace['targets']=train[:,-1]-np.mean(train[:,-1])
+            workspace['n_classes']=0
+        histogram=None
+        if max_bins is not None:
+            workspace['binned'],workspace['thresholds'],workspace['n_bins']=quantize_features(train, max_bins)
+            histogram=node_histogram(workspace, order)
+        root = get_best_split_indexed(workspace, 0, order.shape[0], histogram)
+        run_split_indexed(root, workspace, max_depth, min_size, 1)
+        return root
+    
     # create a root node split by calling get_best_split on the full training set
     root = get_best_split(train)
     # now build the tree using run_split
@@ -262,14 +649,73 @@ def predict_row(node, row):
         else:
             return node['right']
 
+def compile_tree(tree):
+    """
+    Flatten a decision tree of nested dicts into NumPy arrays, one entry per node
+    (the root is node 0, leaves have feature -1)
+    
+    input:
+        tree = decision tree represented as dict (see predict_row)
+    
+    output:
+        dict containing: 1) 'feature' : index of feature used for splitting at each node
+                         2) 'threshold': threshold value of each node
+                         3) 'left', 'right': node numbers of the left and right children
+                         4) 'value': output of each leaf node
+    """
+    feature=[]; threshold=[]; left=[]; right=[]; value=[]
+    
+    def add_node(node):
+        node_id=len(feature)
+        feature.append(-1); threshold.append(0.0); left.append(-1); right.append(-1)
+        if not isinstance(node, dict):
+            value.append(node)
+            return node_id
+        value.append(None)
+        feature[node_id]=node['index']
+        threshold[node_id]=node['value']
+        left[node_id]=add_node(node['left'])
+        right[node_id]=add_node(node['right'])
+        return node_id
+    
+    add_node(tree)
+    # internal nodes get the output of any leaf, so that 'value' has the type of the leaves
+    leaf_value=next(v for v in value if v is not None)
+    value=[leaf_value if v is None else v for v in value]
+    
+    return {'feature':np.asarray(feature, dtype=np.intp), 'threshold':np.asarray(threshold, dtype=float),
+            'left':np.asarray(left, dtype=np.intp), 'right':np.asarray(right, dtype=np.intp),
+            'value':np.asarray(value)}
+
 def predict(tree,testdata):
+    """
+    Predict labels for a test data set, routing all rows through the tree together,
+    one level at a time
+    
+    input:
+        tree = decision tree represented as dict (see predict_row), or as the 
+               flat arrays returned by compile_tree
+        testdata: - an entire test data matrix (n_samples, n_features) or (n_samples,n_features+1)
+    
+    output: 
+        predictions - array of predicted labels for all examples
+    """
+    if 'feature' not in tree:
+        tree=compile_tree(tree)
+    feature,threshold=tree['feature'],tree['threshold']
+    left,right=tree['left'],tree['right']
     
-    predictions=[]
-    for row in testdata:
-        node=deepcopy(tree)
-        predictions.append(predict_row(node, row))
+    testdata=np.asarray(testdata)
+    nodes=np.zeros(testdata.shape[0], dtype=np.intp)
+    # rows that have not yet reached a leaf
+    active=np.flatnonzero(feature[nodes]>=0)
+    while active.shape[0]>0:
+        current=nodes[active]
+        go_left=testdata[active,feature[current]] < threshold[current]
+        nodes[active]=np.where(go_left, left[current], right[current])
+        active=active[feature[nodes[active]]>=0]
         
-    return predictions
+    return tree['value'][nodes]
 
 def score(testlabels, prediction):
     
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bagged ensembles of the from-scratch Decision Tree (DecisionTree.py)
+
+Module versions of the bootstrap_sample and create_bagged_ensemble functions of the
+7.2 Ensemble Learning notebook. Trees can be built in a pool of worker processes,
+which read the training data from a memory-mapped file rather than receiving a
+pickled copy with every task. Each tree draws its bootstrap sample from its own
+random stream, spawned from random_state, so an ensemble is the same whatever
+the number of workers.
+"""
+
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import DecisionTree as DT
+
+# training data of the current worker process, set by attach_training_data
+worker_data = None
+
+
+def bootstrap_indices(n_samples, rng):
+    ''' Draw the row indices of a bootstrap sample (n_samples draws with replacement)
+        input:
+            n_samples: number of rows in the dataset
+            rng: numpy random Generator
+        output:
+            indices: int array (n_samples,)
+    '''
+    return rng.integers(0, n_samples, n_samples)
+
+
+def bootstrap_sample(dataset, random_state=42):
+    ''' Create a random subsample from the dataset with replacement
+        input:
+            dataset: (n_samples,n_features) data array
+            random_state: fixes random seed (int, None or numpy random Generator)
+        output:
+            samples: array of data bootstrapped from dataset
+    '''
+    rng = np.random.default_rng(random_state)
+    return dataset[bootstrap_indices(dataset.shape[0], rng)]
+
+
+def tree_seeds(n_trees, random_state):
+    ''' One independent seed per tree, spawned from random_state '''
+    return np.random.SeedSequence(random_state).spawn(n_trees)
+
+
+def attach_training_data(path):
+    ''' Pool initializer: memory-map the training data saved by create_bagged_ensemble '''
+    global worker_data
+    worker_data = np.load(path, mmap_mode='r')
+
+
+def build_bagged_tree(seed, max_depth, min_size, tree_kwargs, data=None):
+    ''' Build one tree of a bagged ensemble on a bootstrap sample of the training data
+        input:
+            seed: numpy SeedSequence of this tree
+            max_depth, min_size: see DT.build_tree
+            tree_kwargs: dict of further arguments of DT.build_tree
+            data: training data array; defaults to the memory-mapped data of this worker
+        output:
+            tree: decision tree represented as nested dicts
+            in_bag: bitmask of the rows drawn into the bootstrap sample, packed 8 rows per byte
+    '''
+    if data is None:
+        data = worker_data
+    rng = np.random.default_rng(seed)
+    rows = bootstrap_indices(data.shape[0], rng)
+    in_bag = np.zeros(data.shape[0], dtype=bool)
+    in_bag[rows] = True
+    # the same stream then draws the features searched at each node (if max_features is set)
+    tree = DT.build_tree(data, max_depth, min_size, rows=rows, random_state=rng, **tree_kwargs)
+    return tree, np.packbits(in_bag)
+
+
+def in_bag_mask(in_bag, n_samples):
+    ''' Unpack the in-bag bitmask returned by build_bagged_tree into a boolean array (n_samples,) '''
+    return np.unpackbits(in_bag, count=n_samples).astype(bool)
+
+
+def update_oob_votes(oob_votes, tree, data, in_bag, regression=False):
+    ''' Add the votes of one tree for the rows left out of its bootstrap sample
+        input:
+            oob_votes: int array (n_samples,n_classes), updated in place; for regression 
+                       trees, array (n_samples,2) of the sum and number of predictions
+            tree: decision tree
+            data: training data array
+            in_bag: packed in-bag bitmask of the tree
+            regression: True for regression trees
+    '''
+    oob_rows = np.flatnonzero(~in_bag_mask(in_bag, data.shape[0]))
+    if oob_rows.shape[0] == 0:
+        return
+    prediction = DT.predict(tree, data[oob_rows])
+    if regression:
+        oob_votes[oob_rows, 0] += prediction
+        oob_votes[oob_rows, 1] += 1
+    else:
+        oob_votes[oob_rows, prediction.astype(np.intp)] += 1
+
+
+def create_bagged_ensemble(data, max_depth, min_size, n_trees, random_state=42, n_jobs=1,
+                           oob_score=False, **tree_kwargs):
+    ''' Create a bagged ensemble of decision trees
+    input:
+        data: (n_samples,n_features) data array
+        max_depth: max depth of trees
+        min_size: minimum number of samples allowed in tree leaf nodes
+        n_trees: total number of trees in the ensemble
+        random_state: fixes random seed
+        n_jobs: number of worker processes (a positive integer, or -1 to use all cores); with one
+                worker the trees are built in this process
+        oob_score: if True, also estimate the out-of-bag accuracy, voting with each tree
+                   on the rows outside its bootstrap sample as soon as it has been built
+        tree_kwargs: further arguments passed to DT.build_tree (e.g. max_bins, criterion, max_features)
+    output:
+        bagged_ensemble: list of decision trees that make up the bagged ensemble
+        oob: (if oob_score) dict containing: 1) 'in_bag': packed in-bag bitmask of each tree (see in_bag_mask)
+                                             2) 'oob_votes': out-of-bag class votes of every row
+                                             3) 'oob_prediction': majority out-of-bag vote (-1 if never out of bag)
+                                             4) 'oob_score': accuracy of oob_prediction over rows with a vote
+                                             For regression trees (criterion 'variance') 'oob_votes' holds the 
+                                             sum and number of out-of-bag predictions, 'oob_prediction' their 
+                                             mean (nan if never out of bag) and 'oob_score' is the R^2 score.
+    '''
+    seeds = tree_seeds(n_trees, random_state)
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    elif not isinstance(n_jobs, (int, np.integer)) or n_jobs < 1:
+        raise ValueError('n_jobs must be a positive integer or -1, got {}'.format(n_jobs))
+    n_workers = min(n_jobs, n_trees)
+
+    bagged_ensemble = []
+    in_bags = []
+    regression = tree_kwargs.get('criterion') == 'variance'
+    if oob_score and regression:
+        oob_votes = np.zeros((data.shape[0], 2))
+    elif oob_score:
+        oob_votes = np.zeros((data.shape[0], int(data[:, -1].max())+1), dtype=np.intp)
+
+    def collect(results):
+        for tree, in_bag in results:
+            bagged_ensemble.append(tree)
+            in_bags.append(in_bag)
+            if oob_score:
+                update_oob_votes(oob_votes, tree, data, in_bag, regression)
+
+    if n_workers <= 1:
+        collect(build_bagged_tree(seed, max_depth, min_size, tree_kwargs, data) for seed in seeds)
+    else:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'train.npy')
+            np.save(path, np.ascontiguousarray(data))
+            with ProcessPoolExecutor(n_workers, initializer=attach_training_data, initargs=(path,)) as pool:
+                # a few tasks per worker keeps the pool balanced without one task per tree
+                chunksize = max(1, n_trees // (4*n_workers))
+                collect(pool.map(build_bagged_tree, seeds, [max_depth]*n_trees,
+                                 [min_size]*n_trees, [tree_kwargs]*n_trees, chunksize=chunksize))
+
+    if not oob_score:
+        return bagged_ensemble
+
+    if regression:
+        has_vote = oob_votes[:, 1] > 0
+        oob_prediction = np.full(data.shape[0], np.nan)
+        oob_prediction[has_vote] = oob_votes[has_vote, 0]/oob_votes[has_vote, 1]
+        score = r2_score(data[has_vote, -1], oob_prediction[has_vote]) if has_vote.any() else np.nan
+    else:
+        has_vote = oob_votes.sum(axis=1) > 0
+        oob_prediction = np.where(has_vote, np.argmax(oob_votes, axis=1), -1)
+        score = np.mean(oob_prediction[has_vote] == data[has_vote, -1]) if has_vote.any() else np.nan
+    in_bag = np.stack(in_bags) if in_bags else np.zeros((0, (data.shape[0]+7)//8), dtype=np.uint8)
+    oob = {'in_bag': in_bag, 'oob_votes': oob_votes,
+           'oob_prediction': oob_prediction, 'oob_score': score}
+    return bagged_ensemble, oob
+
+
+def compile_forest(trees):
+    ''' Compile a list of trees into one set of flat node arrays (see DT.compile_tree)
+        input:
+            trees: list of decision trees (nested dicts or compiled)
+        output:
+            forest: dict of the concatenated 'feature', 'threshold', 'left', 'right' and
+                    'value' arrays of all trees, plus 'roots': the root node of each tree
+    '''
+    compiled = [tree if 'feature' in tree else DT.compile_tree(tree) for tree in trees]
+    sizes = np.array([tree['feature'].shape[0] for tree in compiled])
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+    forest = {'roots': offsets}
+    for key in ('feature', 'threshold', 'value'):
+        forest[key] = np.concatenate([tree[key] for tree in compiled])
+    # child node numbers are shifted to their position in the concatenated arrays
+    for key in ('left', 'right'):
+        forest[key] = np.concatenate([np.where(tree[key] >= 0, tree[key]+offset, -1)
+                                      for tree, offset in zip(compiled, offsets)])
+    return forest
+
+
+def forest_votes(trees, testdata):
+    ''' Predictions of every tree for every test example, routing all (example, tree) pairs together
+        input:
+            trees: list of decision trees, or a forest from compile_forest
+            testdata: test data matrix (n_samples,n_features) or (n_samples,n_features+1)
+        output:
+            votes: array (n_samples,n_trees) of the prediction of each tree
+    '''
+    forest = trees if isinstance(trees, dict) else compile_forest(trees)
+    feature, threshold = forest['feature'], forest['threshold']
+    left, right = forest['left'], forest['right']
+
+    testdata = np.asarray(testdata)
+    n_samples, n_trees = testdata.shape[0], forest['roots'].shape[0]
+    nodes = np.tile(forest['roots'], n_samples)
+    sample = np.repeat(np.arange(n_samples), n_trees)
+    # (example, tree) pairs that have not yet reached a leaf
+    active = np.flatnonzero(feature[nodes] >= 0)
+    while active.shape[0] > 0:
+        current = nodes[active]
+        go_left = testdata[sample[active], feature[current]] < threshold[current]
+        nodes[active] = np.where(go_left, left[current], right[current])
+        active = active[feature[nodes[active]] >= 0]
+
+    return forest['value'][nodes].reshape((n_samples, n_trees))
+
+
+def aggregate_votes(votes, n_classes):
+    ''' Count the votes for each class of every example
+        input:
+            votes: int array (n_samples,n_trees) of predicted class labels
+            n_classes: number of classes
+        output:
+            counts: int array (n_samples,n_classes)
+    '''
+    votes = votes.astype(np.intp)
+    flat = np.arange(votes.shape[0])[:, None]*n_classes + votes
+    return np.bincount(flat.ravel(), minlength=votes.shape[0]*n_classes).reshape((-1, n_classes))
+
+
+def bagging_predict(trees, testdata, return_proba=False, n_classes=None):
+    ''' Majority vote prediction of a bagged ensemble
+        input:
+            trees: list of decision trees, or a forest from compile_forest
+            testdata: test data matrix
+            return_proba: if True also return the fraction of trees voting for each class
+            n_classes: number of classes (the width of proba); defaults to the largest
+                       class predicted by any leaf of the forest + 1, which misses classes
+                       that no leaf predicts, so pass it when it is known
+        output:
+            predictions: array of predicted class for every test example
+            proba: (if return_proba) array (n_samples,n_classes) of class probabilities
+    '''
+    forest = trees if isinstance(trees, dict) else compile_forest(trees)
+    if n_classes is None:
+        n_classes = int(forest['value'].max())+1
+    counts = aggregate_votes(forest_votes(forest, testdata), n_classes)
+    predictions = np.argmax(counts, axis=1)
+    if return_proba:
+        return predictions, counts/counts.sum(axis=1, keepdims=True)
+    return predictions
+
+
+def r2_score(y_true, y_pred):
+    ''' Coefficient of determination R^2 of a regression, as returned by sklearn's score '''
+    y_true = np.asarray(y_true, dtype=float)
+    return 1 - np.sum((y_true-y_pred)**2)/np.sum((y_true-np.mean(y_true))**2)
+
+
+class RandomForest:
+    ''' Random forest of the from-scratch decision trees: a bagged ensemble whose trees
+        search a random subset of max_features features at each node.
+
+        The fit/predict/score methods follow the scikit-learn estimators;
+        use RandomForestClassifier or RandomForestRegressor.
+    '''
+    criterion = 'gini'
+
+    def __init__(self, n_estimators=100, max_depth=None, min_size=1, max_features='sqrt',
+                 max_bins=None, oob_score=False, n_jobs=1, random_state=None):
+        '''
+        input:
+            n_estimators: number of trees
+            max_depth: max depth of trees (None for no limit)
+            min_size: nodes with at most min_size examples become leaves
+            max_features: features searched at each node (see DT.build_tree)
+            max_bins: if set, use histogram-binned split finding (see DT.build_tree)
+            oob_score: if True, estimate the out-of-bag score while fitting (oob_score_)
+            n_jobs: number of worker processes used to build the trees (-1 for all cores)
+            random_state: fixes random seed
+        '''
+        self.n_estimators = n_estimators
+        self.max_depth = max_depth
+        self.min_size = min_size
+        self.max_features = max_features
+        self.max_bins = max_bins
+        self.oob_score = oob_score
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        ''' Build the forest from training features X (n_samples,n_features) and targets y '''
+        data = np.concatenate((np.asarray(X, dtype=float), np.asarray(y, dtype=float).reshape((-1, 1))), axis=1)
+        result = create_bagged_ensemble(data, self.max_depth, self.min_size, self.n_estimators,
+                                        random_state=self.random_state, n_jobs=self.n_jobs,
+                                        oob_score=self.oob_score, criterion=self.criterion,
+                                        max_features=self.max_features, max_bins=self.max_bins)
+        if self.oob_score:
+            self.estimators_, oob = result
+            self.oob_score_ = oob['oob_score']
+            self.oob_prediction_ = oob['oob_prediction']
+        else:
+            self.estimators_ = result
+        self.n_features_in_ = data.shape[1]-1
+        if self.criterion == 'gini':
+            # class labels are 0, 1, ..., k-1, as for the out-of-bag votes
+            self.n_classes_ = int(data[:, -1].max())+1
+            self.classes_ = np.arange(self.n_classes_)
+        self.forest_ = compile_forest(self.estimators_)
+        return self
+
+
+class RandomForestClassifier(RandomForest):
+    ''' Random forest classifier; class labels must be integers 0, 1, ..., k-1
+        (n_classes_ and classes_ are set by fit) '''
+    criterion = 'gini'
+
+    def predict_proba(self, X):
+        ''' Fraction of trees voting for each class, array (n_samples,n_classes) '''
+        return bagging_predict(self.forest_, np.asarray(X, dtype=float), return_proba=True,
+                               n_classes=self.n_classes_)[1]
+
+    def predict(self, X):
+        ''' Majority vote of the trees for each example '''
+        return bagging_predict(self.forest_, np.asarray(X, dtype=float), n_classes=self.n_classes_)
+
+    def score(self, X, y):
+        ''' Mean accuracy on the given test data and labels '''
+        return np.mean(self.predict(X) == np.asarray(y))
+
+
+class RandomForestRegressor(RandomForest):
+    ''' Random forest regressor (regression trees, criterion 'variance') '''
+    criterion = 'variance'
+
+    def __init__(self, n_estimators=100, max_depth=None, min_size=1, max_features=1.0,
+                 max_bins=None, oob_score=False, n_jobs=1, random_state=None):
+        super().__init__(n_estimators, max_depth, min_size, max_features,
+                         max_bins, oob_score, n_jobs, random_state)
+
+    def predict(self, X):
+        ''' Mean prediction of the trees for each example '''
+        return forest_votes(self.forest_, np.asarray(X, dtype=float)).mean(axis=1)
+
+    def score(self, X, y):
+        ''' Coefficient of determination R^2 of the prediction '''
+        return r2_score(y, self.predict(X))
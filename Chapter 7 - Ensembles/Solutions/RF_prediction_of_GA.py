@@ -11,19 +11,15 @@ Applying Random Forests to the GA regression problem
 from sklearn.tree import DecisionTreeRegressor
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.model_selection import train_test_split
-from sklearn.model_selection import GridSearchCV
-import pandas as pd
 import numpy as np
 
+import ga_dataset
+import hyperparameter_search
 
-# load data
 
-DATAMAT=pd.read_csv('GA-structure-volumes-preterm.csv',header=None)
+# load data (parsed once into a binary cache), separating out data from labels
 
-# separate out data from labals
-
-DATA = DATAMAT.loc[:,1:] # volumes - we have 86 features and 164 samples
-LABELS = DATAMAT[0] # GA - 164 
+DATA, LABELS = ga_dataset.load_ga_dataset('GA-structure-volumes-preterm.csv') # volumes - we have 86 features and 164 samples, GA - 164
 
 # split data into test and train
 X_train, X_test, y_train, y_test = train_test_split(DATA, LABELS, test_size=.4, random_state=42)
@@ -46,15 +42,28 @@ print('Random Forest initial Score', score_RF1)
 # specify parameters and distributions to sample from
 param_dist = {"max_depth": [3, 5, 10, 20, 50],
               "max_features": np.linspace(10,DATA.shape[1],5).astype(int),
-              "n_estimators": [10,20,50,100]
               }
+n_estimators = [10,20,50,100]
 
-grid = GridSearchCV(estimator=RandomForestRegressor(), param_grid=param_dist)
-grid.fit(DATA, LABELS)
+# search on the training set only, in parallel; successive halving drops the worst half of
+# the configurations at each number of trees, and scores are cached in rf_search_cache.jsonl 
+# so that reruns (or a larger grid) only fit the new combinations
+rounds, best = hyperparameter_search.successive_halving(param_dist, X_train, y_train, n_estimators,
+                                                        cache_path='rf_search_cache.jsonl')
 
-# summarize the results of the grid search
-print('Best classification score achieved using grid search:', grid.best_score_)
+# summarize the results of the search
+print('Best cross-validation score achieved using the search:', best['mean_score'])
 print('The parameters resulting in the best score are depth: {},max_f {} and n_estimators {} '.format(
-        grid.best_estimator_.max_depth,grid.best_estimator_.max_features,grid.best_estimator_.n_estimators))
-      
+        best['params']['max_depth'],best['params']['max_features'],best['params']['n_estimators']))
 
+# evaluate the best parameters on the held-out test set
+clf=RandomForestRegressor(random_state=42, **best['params'])
+clf.fit(X_train, y_train)
+print('Random Forest optimised test Score', clf.score(X_test, y_test))
+
+# n_estimators learning curve of the best parameters: one forest is grown step by step
+# (warm start) and scored on the test set at every number of trees
+params = {name: value for name, value in best['params'].items() if name != 'n_estimators'}
+curve = hyperparameter_search.warm_start_curve(params, X_train, y_train, X_test, y_test, [10,20,50,100,200])
+for trees, score, fit_time in zip(curve['n_estimators'], curve['score'], curve['fit_time']):
+    print('{} trees: test score {:.4f} (fitted in {:.2f}s)'.format(trees, score, fit_time))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the from-scratch Decision Tree (DecisionTree.py) and bagged
+ensembles (Ensemble.py), compared against scikit-learn.
+
+For every dataset size (n_samples, n_features) and method, reports fit time,
+predict time, peak resident memory and test accuracy. Each benchmark runs in its own
+process so that peak memory is measured separately. Results are written as
+a JSON or CSV table so that runs can be compared over time.
+
+Run from this folder, e.g.:
+    python benchmark_trees.py --sizes 100 1000 10000 --features 2 10 --output results.csv
+    python benchmark_trees.py --methods tree tree_binned --max-bins 256 64 16
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.datasets import make_classification, make_moons
+from sklearn.ensemble import BaggingClassifier
+from sklearn.model_selection import train_test_split
+from sklearn.tree import DecisionTreeClassifier
+
+import DecisionTree as DT
+import Ensemble
+
+METHODS = ('tree', 'tree_binned', 'bagging', 'sklearn_tree', 'sklearn_bagging')
+FIELDS = ('dataset', 'n_samples', 'n_features', 'method', 'max_bins', 'fit_time',
+          'predict_time', 'peak_rss_mb', 'accuracy')
+
+
+def make_dataset(n_samples, n_features, random_state=42):
+    ''' Create a binary classification problem in the form expected by DecisionTree:
+        make_moons for 2 features, make_classification otherwise
+        input:
+            n_samples: number of examples
+            n_features: number of features
+            random_state: fixes random seed
+        output:
+            name: name of the sklearn generator used
+            train, test: data arrays (n_samples,n_features+1) with labels in the last column
+    '''
+    if n_features == 2:
+        name = 'make_moons'
+        X, y = make_moons(n_samples=n_samples, noise=0.3, random_state=random_state)
+    else:
+        name = 'make_classification'
+        X, y = make_classification(n_samples=n_samples, n_features=n_features,
+                                   n_informative=max(2, n_features//2), random_state=random_state)
+    data = np.concatenate((X, y.reshape((-1, 1))), axis=1)
+    train, test = train_test_split(data, test_size=.2, random_state=random_state)
+    return name, train, test
+
+
+def peak_rss_mb():
+    ''' Peak resident set size of this process in MB (ru_maxrss is in kB on Linux, bytes on macOS) '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/2**20 if sys.platform == 'darwin' else peak/2**10
+
+
+def run_case(n_samples, n_features, method, max_depth=8, min_size=1, n_trees=10, max_bins=256):
+    ''' Fit and test one method on one dataset size
+        output:
+            result: dict with the fields of FIELDS
+    '''
+    name, train, test = make_dataset(n_samples, n_features)
+    X_train, y_train = train[:, :-1], train[:, -1]
+    X_test, y_test = test[:, :-1], test[:, -1]
+
+    start = time.perf_counter()
+    if method == 'tree':
+        model = DT.build_tree(train, max_depth, min_size)
+    elif method == 'tree_binned':
+        model = DT.build_tree(train, max_depth, min_size, max_bins=max_bins)
+    elif method == 'bagging':
+        model = Ensemble.create_bagged_ensemble(train, max_depth, min_size, n_trees)
+    elif method == 'sklearn_tree':
+        model = DecisionTreeClassifier(max_depth=max_depth, min_samples_split=min_size+1).fit(X_train, y_train)
+    elif method == 'sklearn_bagging':
+        model = BaggingClassifier(DecisionTreeClassifier(max_depth=max_depth, min_samples_split=min_size+1),
+                                  n_estimators=n_trees).fit(X_train, y_train)
+    else:
+        raise ValueError('unknown method {}, expected one of {}'.format(method, METHODS))
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if method in ('tree', 'tree_binned'):
+        prediction = DT.predict(model, X_test)
+    elif method == 'bagging':
+        prediction = Ensemble.bagging_predict(model, X_test)
+    else:
+        prediction = model.predict(X_test)
+    predict_time = time.perf_counter() - start
+
+    return {'dataset': name, 'n_samples': n_samples, 'n_features': n_features, 'method': method,
+            'max_bins': max_bins if method == 'tree_binned' else None,
+            'fit_time': fit_time, 'predict_time': predict_time,
+            'peak_rss_mb': peak_rss_mb(), 'accuracy': float(np.mean(prediction == y_test))}
+
+
+def run_benchmarks(sizes=(100, 1000, 10000, 100000, 1000000), features=(2, 10, 100), methods=METHODS,
+                   max_bins=(256,), **case_kwargs):
+    ''' Run every combination of dataset size, number of features and method, each in a fresh process
+        output:
+            results: list of result dicts (see run_case)
+    '''
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for n_samples in sizes:
+        for n_features in features:
+            for method in methods:
+                for bins in (max_bins if method == 'tree_binned' else max_bins[:1]):
+                    with ProcessPoolExecutor(1, mp_context=context) as pool:
+                        result = pool.submit(run_case, n_samples, n_features, method,
+                                             max_bins=bins, **case_kwargs).result()
+                    results.append(result)
+                    print('{dataset:>19} n={n_samples:>8} d={n_features:>4} {method:>15} '
+                          'bins={max_bins!s:>4}: fit {fit_time:9.3f}s predict {predict_time:8.3f}s '
+                          'rss {peak_rss_mb:8.1f}MB accuracy {accuracy:.4f}'.format(**result), flush=True)
+    return results
+
+
+def write_results(results, path):
+    ''' Write results as JSON (.json) or CSV (any other extension) '''
+    if path.endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark DecisionTree against scikit-learn')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000, 1000000],
+                        help='numbers of samples')
+    parser.add_argument('--features', type=int, nargs='+', default=[2, 10, 100],
+                        help='numbers of features (2 uses make_moons)')
+    parser.add_argument('--methods', nargs='+', default=list(METHODS), choices=METHODS)
+    parser.add_argument('--max-bins', type=int, nargs='+', default=[256],
+                        help='bin counts trialled by the tree_binned method')
+    parser.add_argument('--max-depth', type=int, default=8)
+    parser.add_argument('--min-size', type=int, default=1)
+    parser.add_argument('--n-trees', type=int, default=10, help='trees in the bagged ensembles')
+    parser.add_argument('--output', default='benchmark_results.csv', help='.json or .csv results file')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.features, args.methods, args.max_bins,
+                             max_depth=args.max_depth, min_size=args.min_size, n_trees=args.n_trees)
+    write_results(results, args.output)
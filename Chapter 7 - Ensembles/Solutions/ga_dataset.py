@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Loader for the header-less GA-*-volumes*.csv datasets (GA in the first column,
+one structure volume per remaining column), used by the Chapter 7 scripts
+(rf_demo.py and RF_prediction_of_GA.py). The notebooks of the other chapters read
+their copies of these files with their own CreateFeaturesTargets.
+
+The first load of a CSV file converts it to a binary .npy cache (in a .cache
+folder next to it), together with a small JSON record of the source file's
+modification time, size and SHA-1 hash, and of the feature means and standard
+deviations. Later loads memory-map the .npy file instead of parsing the CSV, and
+can standardise the features from the cached parameters instead of refitting a
+StandardScaler. The cache is rebuilt whenever the content of the CSV changes:
+
+    X, y = load_ga_dataset('GA-structure-volumes-preterm.csv')
+    X, y, scaler = load_ga_dataset('GA-structure-volumes-preterm.csv', standardise=True)
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+
+
+def file_hash(path, block_size=2**20):
+    ''' SHA-1 hash of a file's content, read in blocks '''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_paths(csv_path, cache_dir=None):
+    ''' Paths of the .npy data and .json record caching csv_path '''
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(csv_path)), '.cache')
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(cache_dir, name + '.npy'), os.path.join(cache_dir, name + '.json')
+
+
+def build_cache(csv_path, cache_dir=None):
+    ''' Parse the CSV file once and write its .npy cache and JSON record
+        output:
+            record: dict of the source file's mtime, size and hash, the data shape and
+                    the feature means and standard deviations
+    '''
+    data_path, record_path = cache_paths(csv_path, cache_dir)
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+    data = pd.read_csv(csv_path, header=None).to_numpy(dtype=np.float64)
+    np.save(data_path, data)
+    stat = os.stat(csv_path)
+    record = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha1': file_hash(csv_path),
+              'shape': list(data.shape),
+              'mean': data[:, 1:].mean(axis=0).tolist(), 'std': data[:, 1:].std(axis=0).tolist()}
+    with open(record_path, 'w') as f:
+        json.dump(record, f)
+    return record
+
+
+def cached_record(csv_path, cache_dir=None):
+    ''' Record of an up-to-date cache of csv_path, building (or rebuilding) the cache if needed.
+        The cache is current if the file's mtime and size are unchanged; otherwise its
+        content hash is compared, so touching the file does not trigger a rebuild. '''
+    data_path, record_path = cache_paths(csv_path, cache_dir)
+    if not (os.path.exists(data_path) and os.path.exists(record_path)):
+        return build_cache(csv_path, cache_dir)
+    with open(record_path) as f:
+        record = json.load(f)
+    stat = os.stat(csv_path)
+    if (record['mtime_ns'], record['size']) == (stat.st_mtime_ns, stat.st_size):
+        return record
+    if record['size'] != stat.st_size or record['sha1'] != file_hash(csv_path):
+        return build_cache(csv_path, cache_dir)
+    record['mtime_ns'] = stat.st_mtime_ns
+    with open(record_path, 'w') as f:
+        json.dump(record, f)
+    return record
+
+
+def cached_scaler(record):
+    ''' StandardScaler fitted from the feature means and standard deviations of a cache record '''
+    scaler = StandardScaler()
+    scaler.mean_ = np.array(record['mean'])
+    scaler.var_ = np.square(record['std'])
+    # constant features are left unscaled, as by StandardScaler
+    scaler.scale_ = np.where(scaler.var_ > 0, np.array(record['std']), 1.0)
+    scaler.n_features_in_ = len(record['mean'])
+    scaler.n_samples_seen_ = record['shape'][0]
+    return scaler
+
+
+def load_ga_dataset(csv_path, standardise=False, mmap_mode='r', cache_dir=None):
+    ''' Load a GA-*-volumes*.csv dataset through its binary cache
+        input:
+            csv_path: header-less CSV file, GA in the first column
+            standardise: if True, also standardise the features (zero mean, unit variance)
+                         using the cached scaling parameters, and return the scaler
+            mmap_mode: mode in which the cache is memory-mapped ('r'), or None to read it
+            cache_dir: folder of the cache, by default .cache next to the CSV file
+        output:
+            X: features, array (n_samples, n_features) (read-only view of the memory-map,
+               unless standardised)
+            y: GA, array (n_samples,)
+            scaler: (if standardise) the fitted StandardScaler, to transform new data
+    '''
+    record = cached_record(csv_path, cache_dir)
+    data = np.load(cache_paths(csv_path, cache_dir)[0], mmap_mode=mmap_mode)
+    X, y = data[:, 1:], data[:, 0]
+    if standardise:
+        scaler = cached_scaler(record)
+        return scaler.transform(X), y, scaler
+    return X, y
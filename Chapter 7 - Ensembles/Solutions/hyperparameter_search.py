@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cached, parallel hyperparameter search for random forests.
+
+Every (parameters, fold) cross-validation score is computed in a pool of worker
+processes and appended to an on-disk cache (one JSON record per line), keyed on
+the parameters, the fold, the cross-validation set-up and a hash of the data.
+Rerunning a search, or extending its grid, only fits the combinations that have
+not been scored before.
+
+successive_halving scores every configuration with few trees first and only
+keeps the best 1/factor of them for each larger n_estimators, so that bad
+configurations are dropped early, e.g.:
+
+    results, best = successive_halving({'max_depth': [3, 5, 10], 'max_features': [10, 48, 86]},
+                                       X_train, y_train, n_estimators=[10, 20, 50, 100])
+
+warm_start_curve instead grows a single forest, adding trees up to each number of
+trees in turn, so the validation score of every n_estimators comes for the cost
+of one fit of the largest forest.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.model_selection import KFold, ParameterGrid
+
+
+def data_fingerprint(X, y):
+    ''' Hash of the data values, so that cached scores are only reused for the same data '''
+    digest = hashlib.sha1()
+    for array in (X, y):
+        array = np.ascontiguousarray(array, dtype=float)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def plain_params(params):
+    ''' Parameters with numpy scalars converted to python types, so they can be stored as JSON '''
+    return {name: value.item() if isinstance(value, np.generic) else value for name, value in params.items()}
+
+
+def cache_key(params, fold, setup):
+    ''' Key of one (parameters, fold) score: the parameters, the fold number and the search
+        set-up (data hash, number of folds, random seed) '''
+    return json.dumps({'params': plain_params(params), 'fold': fold, **setup}, sort_keys=True)
+
+
+def load_cache(path):
+    ''' Read the scores of a cache file into a dict {key: score} (empty if there is no file yet) '''
+    cache = {}
+    if path is not None and os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    cache[record['key']] = record['score']
+    return cache
+
+
+def append_cache(path, records):
+    ''' Append (key, score) records to a cache file '''
+    with open(path, 'a') as f:
+        for key, score in records:
+            f.write(json.dumps({'key': key, 'score': score}) + '\n')
+
+
+def fold_score(X, y, train_index, test_index, params, random_state):
+    ''' Fit a random forest on one training fold and return its R^2 score on the validation fold '''
+    model = RandomForestRegressor(random_state=random_state, **params)
+    model.fit(X[train_index], y[train_index])
+    return model.score(X[test_index], y[test_index])
+
+
+def cached_search(param_grid, X, y, cv=5, n_jobs=-1, cache_path='search_cache.jsonl', random_state=42):
+    ''' Cross-validated grid search of RandomForestRegressor, parallel across folds and
+        candidates, reusing (and extending) the scores cached in cache_path
+        input:
+            param_grid: dict (or list of dicts) of parameter lists, as for GridSearchCV
+            X, y: training data and targets
+            cv: number of (shuffled) K-fold splits
+            n_jobs: number of worker processes (-1 for all cores)
+            cache_path: JSON-lines score cache, or None for no cache
+            random_state: fixes the folds and the forests' random seeds
+        output:
+            results: list of dicts 'params', 'scores' (per fold), 'mean_score', 'std_score',
+                     best mean score first
+    '''
+    X = np.asarray(X, dtype=float)
+    y = np.asarray(y, dtype=float)
+    setup = {'data': data_fingerprint(X, y), 'cv': cv, 'random_state': random_state}
+    folds = list(KFold(cv, shuffle=True, random_state=random_state).split(X))
+    candidates = list(ParameterGrid(param_grid))
+
+    cache = load_cache(cache_path)
+    missing = [(params, fold) for params in candidates for fold in range(cv)
+               if cache_key(params, fold, setup) not in cache]
+    if missing:
+        scores = Parallel(n_jobs=n_jobs)(delayed(fold_score)(X, y, *folds[fold], params, random_state)
+                                         for params, fold in missing)
+        records = [(cache_key(params, fold, setup), score) for (params, fold), score in zip(missing, scores)]
+        cache.update(records)
+        if cache_path is not None:
+            append_cache(cache_path, records)
+
+    results = []
+    for params in candidates:
+        scores = np.array([cache[cache_key(params, fold, setup)] for fold in range(cv)])
+        results.append({'params': plain_params(params), 'scores': scores,
+                        'mean_score': scores.mean(), 'std_score': scores.std()})
+    return sorted(results, key=lambda result: -result['mean_score'])
+
+
+def successive_halving(param_grid, X, y, n_estimators=(10, 20, 50, 100), factor=2, **search_kwargs):
+    ''' Successive halving over n_estimators: every configuration of param_grid is scored
+        with the fewest trees, then only the best 1/factor of them go on to the next
+        number of trees, and so on
+        input:
+            param_grid: dict of parameter lists, without n_estimators
+            X, y: training data and targets
+            n_estimators: increasing numbers of trees (the resource of each round)
+            factor: fraction of configurations dropped in each round is 1-1/factor
+            search_kwargs: cv, n_jobs, cache_path, random_state (see cached_search)
+        output:
+            rounds: list of the results of each round (see cached_search)
+            best: results of the best configuration with the most trees
+    '''
+    candidates = [plain_params(params) for params in ParameterGrid(param_grid)]
+    rounds = []
+    for trees in sorted(n_estimators):
+        grid = [{**{name: [value] for name, value in params.items()}, 'n_estimators': [trees]}
+                for params in candidates]
+        results = cached_search(grid, X, y, **search_kwargs)
+        rounds.append(results)
+        n_keep = max(1, int(np.ceil(len(results)/factor)))
+        candidates = [{name: value for name, value in result['params'].items() if name != 'n_estimators'}
+                      for result in results[:n_keep]]
+    return rounds, rounds[-1][0]
+
+
+def warm_start_curve(params, X_train, y_train, X_val, y_val, n_estimators=(10, 20, 50, 100), random_state=42):
+    ''' n_estimators learning curve from one forest grown with warm_start: trees are added
+        up to each number of trees in turn and the forest scored at every checkpoint.
+        With a fixed random_state, the forest at each checkpoint is the same as one fitted
+        from scratch with that many trees.
+        input:
+            params: RandomForestRegressor parameters other than n_estimators
+            X_train, y_train: training data and targets
+            X_val, y_val: validation data and targets
+            n_estimators: increasing numbers of trees (the checkpoints)
+            random_state: fixes the forest's random seed
+        output:
+            curve: dict of arrays 'n_estimators', 'score' (validation R^2) and
+                   'fit_time' (cumulative seconds of fitting)
+    '''
+    model = RandomForestRegressor(warm_start=True, random_state=random_state, **params)
+    curve = {'n_estimators': np.array(sorted(n_estimators)), 'score': [], 'fit_time': []}
+    fit_time = 0
+    for trees in curve['n_estimators']:
+        model.set_params(n_estimators=int(trees))
+        start = time.perf_counter()
+        model.fit(X_train, y_train)
+        fit_time += time.perf_counter() - start
+        curve['score'].append(model.score(X_val, y_val))
+        curve['fit_time'].append(fit_time)
+    curve['score'] = np.array(curve['score'])
+    curve['fit_time'] = np.array(curve['fit_time'])
+    return curve
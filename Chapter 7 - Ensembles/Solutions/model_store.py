@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Model store for fitted forests, and batch scoring of large CSV files.
+
+A fitted model is saved with joblib together with its feature schema (number
+and names of the features), the parameters it was trained with and a hash of its
+training data. load_or_train reuses a saved model only if all three match, and
+retrains it otherwise.
+
+Loading reads the whole model into memory: the trees of a scikit-learn forest
+copy their node arrays into their own buffers when unpickled, so memory-mapping
+the store (mmap_mode='r') does not reduce the memory used by a forest.
+
+Batch scoring streams a CSV of brain volumes (in the format of
+GA-structure-volumes-preterm.csv, i.e. GA in the first column, unless --no-labels
+is given) through the model's predict in chunks, so memory use is bounded by the
+chunk size rather than the file size, e.g.:
+
+    python model_store.py rf_GA_model.joblib volumes.csv --output predictions.csv --chunksize 10000
+"""
+
+import argparse
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from hyperparameter_search import data_fingerprint
+
+
+def model_schema(X, feature_names=None):
+    ''' Feature schema of a model trained on X: number and names of the features '''
+    return {'n_features': np.shape(X)[1],
+            'feature_names': None if feature_names is None else [str(name) for name in feature_names]}
+
+
+def save_model(model, path, X, y, feature_names=None, **metadata):
+    ''' Save a fitted model with its feature schema and a hash of its training data
+        input:
+            model: fitted estimator
+            path: file to write (e.g. rf_GA_model.joblib)
+            X, y: training data and targets of the model
+            feature_names: optional list of the names of the features (columns of X)
+            metadata: any other values to store with the model (e.g. params, see load_or_train)
+    '''
+    store = {'model': model,
+             'schema': model_schema(X, feature_names),
+             'data_hash': data_fingerprint(X, y),
+             'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+             **metadata}
+    joblib.dump(store, path)
+
+
+def load_model(path, mmap_mode=None):
+    ''' Load a saved model
+        input:
+            path: file written by save_model
+            mmap_mode: passed to joblib.load; it only memory-maps numpy arrays stored as
+                       such, not the node arrays of scikit-learn trees, which are copied
+                       into memory when the model is unpickled
+        output:
+            model: the fitted estimator
+            store: dict of the schema, data hash and metadata saved with it
+    '''
+    store = joblib.load(path, mmap_mode=mmap_mode)
+    return store.pop('model'), store
+
+
+def check_schema(store, X):
+    ''' Raise a ValueError if X does not have the features the model was trained on '''
+    n_features = store['schema']['n_features']
+    if X.shape[1] != n_features:
+        raise ValueError('model expects {} features, got {}'.format(n_features, X.shape[1]))
+
+
+def load_or_train(path, X, y, train, feature_names=None, params=None):
+    ''' Load the model saved at path if it was trained with the same parameters, on the
+        same data (same hash) and features, otherwise train it with train(X, y, **params)
+        and save it
+        input:
+            path: model file
+            X, y: training data and targets
+            train: function fitting and returning a model
+            feature_names: optional list of the names of the features (columns of X)
+            params: dict of the parameters passed to train, stored with the model, so that
+                    changing them retrains it
+        output:
+            model: the fitted estimator
+            trained: True if the model had to be trained
+    '''
+    params = {} if params is None else dict(params)
+    try:
+        model, store = load_model(path)
+        if (store['data_hash'] == data_fingerprint(X, y) and store['schema'] == model_schema(X, feature_names)
+                and store.get('params') == params):
+            return model, False
+    except FileNotFoundError:
+        pass
+    model = train(X, y, **params)
+    save_model(model, path, X, y, feature_names, params=params)
+    return model, True
+
+
+def score_csv(model_path, csv_path, output_path, chunksize=10000, labels=True):
+    ''' Predict every row of a (large) CSV file, reading and writing it in chunks
+        input:
+            model_path: saved model (see save_model)
+            csv_path: CSV file without header, one example per row
+            output_path: CSV file for the predictions
+            chunksize: number of rows read and predicted at a time
+            labels: if True, the first column holds the targets (e.g. GA) and is
+                    copied to the output next to the predictions
+        output:
+            n_rows: number of rows scored
+    '''
+    model, store = load_model(model_path)
+    n_rows = 0
+    with open(output_path, 'w') as output:
+        output.write('target,prediction\n' if labels else 'prediction\n')
+        for chunk in pd.read_csv(csv_path, header=None, chunksize=chunksize):
+            values = chunk.to_numpy(dtype=float)
+            X = values[:, 1:] if labels else values
+            check_schema(store, X)
+            prediction = model.predict(X)
+            columns = (values[:, 0], prediction) if labels else (prediction,)
+            np.savetxt(output, np.column_stack(columns), delimiter=',', fmt='%.6g')
+            n_rows += len(values)
+    return n_rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch scoring of a CSV file with a saved model')
+    parser.add_argument('model', help='saved model file')
+    parser.add_argument('csv', help='CSV file (no header) to score')
+    parser.add_argument('--output', default='predictions.csv', help='CSV file for the predictions')
+    parser.add_argument('--chunksize', type=int, default=10000, help='rows read and predicted at a time')
+    parser.add_argument('--no-labels', action='store_true', help='the CSV has no target (GA) first column')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    n_rows = score_csv(args.model, args.csv, args.output, args.chunksize, labels=not args.no_labels)
+    print('scored {} rows in {:.2f}s, predictions written to {}'.format(
+        n_rows, time.perf_counter() - start, args.output))
@@ -6,24 +6,26 @@ This is a temporary script file.
 """
 
 from sklearn.ensemble import RandomForestRegressor # import ML method from scikit learn
-import pandas as pd # library for reading dataframes (spreadsheets)
 from sklearn.model_selection import train_test_split
+import ga_dataset # load the csv data through a binary cache
+import model_store # save and reload fitted models
 
-# load data
-DATAMAT=pd.read_csv('GA-structure-volumes-preterm.csv', header=None, )
+# load data, separating out data from labels
 
-# separate out data from labals
-
-DATA = DATAMAT.loc[:,1:] # volumes - we have 86 features and 164 samples
-LABELS = DATAMAT[0] # GA - 164 
+DATA, LABELS = ga_dataset.load_ga_dataset('GA-structure-volumes-preterm.csv') # volumes - we have 86 features and 164 samples, GA - 164
 
 
 # create a test and train data set using scikit learn method train_test_split
-X_train, X_test, y_train, y_test =train_test_split(DATA,LABELS,test_size=0.2)
+X_train, X_test, y_train, y_test =train_test_split(DATA,LABELS,test_size=0.2,random_state=42)
 
-model=RandomForestRegressor(n_estimators=100)
+# train the forest, or reload it from rf_GA_model.joblib if it was already trained with
+# these parameters on this data
+params={'n_estimators':100, 'random_state':42}
+def train(X, y, **params):
+    return RandomForestRegressor(**params).fit(X, y)
 
-model.fit(X_train,y_train)
+model,trained=model_store.load_or_train('rf_GA_model.joblib',X_train,y_train,train,params=params)
+print('trained a new model' if trained else 'loaded the saved model')
 
 train_performance=model.score(X_train,y_train)
 